@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+scripts/bench_loop_lag.py
+
+Лаг event loop при параллельных /analyze по большим документам —
+«до» (CPU_POOL_KIND=inline: tiktoken и JSON прямо в loop) и «после»
+(process / thread пул из utils/offload.py).
+
+LLM подменён тем же фейковым транспортом, что в bench_memory.py;
+документы у запросов разные, чтобы не срабатывал кэш токенов по хэшу.
+
+Как использовать:
+    cd /path/to/project/root
+    python scripts/bench_loop_lag.py --size-mb 2 --concurrency 4
+    python scripts/bench_loop_lag.py --kinds inline thread process
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# bench_memory выставляет заглушки ключей и добавляет корень проекта в sys.path
+sys.path.append(str(Path(__file__).resolve().parent))
+from bench_memory import _StreamingMockTransport, _make_document
+
+import httpx
+from tz_expert.schemas import AnalyzeRequest
+from tz_expert.services import llm_service
+from tz_expert.services.analyzer import AnalyzerService
+from tz_expert.services.loop_lag import LoopLagMonitor
+from tz_expert.services.repository import YamlRuleRepository
+from tz_expert.settings import settings
+from tz_expert.utils import offload, tokens
+
+
+async def _measure(kind: str, docs: list[str], interval: float) -> None:
+    settings.cpu_pool_kind = kind
+    offload.shutdown_pool()
+    tokens._count_cache.clear()
+    await offload.start_pool()          # spawn воркеров — вне замера
+
+    svc = AnalyzerService(YamlRuleRepository())
+    monitor = LoopLagMonitor(interval=interval, warn=float("inf"))
+    monitor.start()
+    await asyncio.sleep(interval * 5)   # базовая линия
+    t0 = time.perf_counter()
+    await asyncio.gather(*(svc.analyze(AnalyzeRequest(html=html)) for html in docs))
+    elapsed = time.perf_counter() - t0
+    await monitor.stop()
+    offload.shutdown_pool()
+
+    lag = monitor.snapshot()
+    print(f"{kind:8s} elapsed {elapsed:6.2f} s   lag mean {lag['mean_ms']:6.1f} ms"
+          f"   p99 {lag['p99_ms']:7.1f} ms   max {lag['max_ms']:7.1f} ms")
+
+
+async def _run(args) -> None:
+    transport = _StreamingMockTransport()
+    llm_service.or_client = httpx.AsyncClient(base_url=llm_service.or_client.base_url, transport=transport)
+    llm_service.yc_client = httpx.AsyncClient(base_url=llm_service.yc_client.base_url, transport=transport)
+
+    base = _make_document(args.size_mb)
+    print(f"document: {len(base.encode('utf-8')) / 2**20:.2f} MiB × {args.concurrency}, "
+          f"pool workers: {settings.cpu_pool_workers}")
+    for n, kind in enumerate(args.kinds):
+        # свой набор документов на прогон — кэш по хэшу не должен помогать
+        docs = [f"{base}<p>{n}-{i}</p>" for i in range(args.concurrency)]
+        await _measure(kind, docs, args.interval)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size-mb", type=float, default=2.0, help="размер синтетического HTML, MiB")
+    ap.add_argument("--concurrency", type=int, default=4, help="одновременных запросов analyze")
+    ap.add_argument("--kinds", nargs="+", default=["inline", "process"],
+                    choices=["inline", "thread", "process"], help="какие CPU_POOL_KIND сравнить")
+    ap.add_argument("--interval", type=float, default=0.01, help="шаг замера лага, сек.")
+    asyncio.run(_run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
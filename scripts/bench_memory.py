@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+scripts/bench_memory.py
+
+Память на один параллельный запрос /analyze при большом документе:
+  • tracemalloc — пик Python-аллокаций за прогон;
+  • ru_maxrss   — прирост пикового RSS процесса.
+
+LLM-провайдеры подменены фейковым транспортом: тело запроса читается
+по фрагментам (как его отправил бы httpx в сокет) и не склеивается
+(httpx.MockTransport склеивает — и портит замер), ответы — минимальные
+валидные JSON. Сеть и Postgres не нужны
+(справочник из groups.yaml / errors.yaml).
+
+Как использовать:
+    cd /path/to/project/root
+    python scripts/bench_memory.py --size-mb 2 --concurrency 4
+    python scripts/bench_memory.py --model yandexgpt/latest
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# Чтобы Python нашёл пакет tz_expert, добавляем корень проекта в sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+# settings требует ключи — для офлайн-прогона хватит заглушек
+for var in ("OR_API_KEY", "OR_REFERER", "YC_API_KEY", "YC_FOLDER_ID"):
+    os.environ.setdefault(var, "bench")
+
+import httpx
+from tz_expert.schemas import AnalyzeRequest
+from tz_expert.services import llm_service
+from tz_expert.services.analyzer import AnalyzerService
+from tz_expert.services.repository import YamlRuleRepository
+
+_GROUP_CODE_RE = re.compile(r"Код: (E\d{2}[A-Z]?)")
+_DEEP_CODE_RE  = re.compile(r"'Код ошибки' : '(E\d{2}[A-Z]?)'")
+_TAIL = 64 * 1024          # правила и system-промпт — в хвосте/голове тела
+
+
+async def _fake_llm(request: httpx.Request) -> httpx.Response:
+    """Ответ по содержимому промпта; документ читается потоком и выбрасывается."""
+    head, tail, size = b"", b"", 0
+    async for chunk in request.stream:
+        size += len(chunk)
+        if len(head) < _TAIL:
+            head += chunk[:_TAIL]
+        tail = (tail + chunk[-_TAIL:])[-_TAIL:]
+    text = (head[:_TAIL] + tail).decode("utf-8", "ignore")
+
+    if "DEEP" in text:
+        code = _DEEP_CODE_RE.search(text).group(1)
+        answer = {"code": code, "title": "-", "findings": [
+            {"kind": "Invalid", "paragraph": "num0001", "quote": "-", "advice": "-"}
+        ]}
+    elif "групповой" in text:
+        answer = {"results": [
+            {"code": c, "exists": i % 3 == 0, "confidence": 0.9}
+            for i, c in enumerate(dict.fromkeys(_GROUP_CODE_RE.findall(text)))
+        ]}
+    else:
+        answer = {"exists": True, "confidence": 0.9}
+
+    content = json.dumps(answer, ensure_ascii=False)
+    usage = {"prompt": size // 4, "completion": len(content) // 4}
+    if request.url.host.endswith("yandex.net"):
+        body = {"result": {
+            "alternatives": [{"message": {"role": "assistant", "text": content}}],
+            "usage": {"inputTextTokens": usage["prompt"], "completionTokens": usage["completion"],
+                      "totalTokens": usage["prompt"] + usage["completion"]},
+        }}
+    else:
+        body = {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": usage["prompt"], "completion_tokens": usage["completion"],
+                      "total_tokens": usage["prompt"] + usage["completion"]},
+        }
+    return httpx.Response(200, json=body)
+
+
+class _StreamingMockTransport(httpx.AsyncBaseTransport):
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await _fake_llm(request)
+
+
+def _make_document(size_mb: float) -> str:
+    para = "<p class=\"num{:04d}\">Поставщик обязан поставить насосное оборудование в срок.</p>"
+    parts, total, i = [], 0, 0
+    while total < size_mb * 1024 * 1024:
+        p = para.format(i % 10000)
+        parts.append(p)
+        total += len(p.encode("utf-8"))
+        i += 1
+    return "<h1>ТЗ: поставка насосов</h1>" + "".join(parts)
+
+
+async def _run(args) -> None:
+    transport = _StreamingMockTransport()
+    llm_service.or_client = httpx.AsyncClient(base_url=llm_service.or_client.base_url, transport=transport)
+    llm_service.yc_client = httpx.AsyncClient(base_url=llm_service.yc_client.base_url, transport=transport)
+
+    svc  = AnalyzerService(YamlRuleRepository())
+    html = _make_document(args.size_mb)
+    reqs = [AnalyzeRequest(html=html, model=args.model) for _ in range(args.concurrency)]
+    plans = [await svc.plan(r) for r in reqs]  # токенизация — вне замера
+
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    responses = await asyncio.gather(*(svc.analyze(r, plan=p) for r, p in zip(reqs, plans)))
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    doc_bytes = len(html.encode("utf-8"))
+    calls = sum(sum(s.calls for s in r.stages.values()) for r in responses)
+    print(f"document:         {doc_bytes / 2**20:.2f} MiB")
+    print(f"concurrency:      {args.concurrency}  (LLM calls: {calls})")
+    print(f"elapsed:          {elapsed:.2f} s")
+    print(f"tracemalloc peak: {peak / 2**20:.1f} MiB total, "
+          f"{peak / args.concurrency / 2**20:.1f} MiB per request "
+          f"(≈{peak / args.concurrency / doc_bytes:.1f}× документа)")
+    print(f"maxrss growth:    {(rss1 - rss0) / 1024:.1f} MiB total, "
+          f"{(rss1 - rss0) / 1024 / args.concurrency:.1f} MiB per request")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size-mb", type=float, default=2.0, help="размер синтетического HTML, MiB")
+    ap.add_argument("--concurrency", type=int, default=4, help="одновременных запросов analyze")
+    ap.add_argument("--model", default=None, help="как AnalyzeRequest.model (yandexgpt/latest → Yandex)")
+    asyncio.run(_run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
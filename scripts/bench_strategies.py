@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+scripts/bench_strategies.py
+
+Стоимость vs качество стратегий оркестрации на размеченном корпусе
+(bench/labels.yaml + bench/corpus/*.html):
+  • group  — групповой триаж по groups.yaml (как /analyze без codes);
+  • single — одиночный триаж по каждому коду тех же групп.
+
+Каждая стратегия прогоняется через AnalyzerService для каждой модели.
+Ответы LLM берутся из кассет bench/cassettes/<модель>.json — без сети.
+Кассета — это записанные ответы: obj, usage и латентность вызова, ключ —
+модель + содержимое сообщений. Промпт поменялся — ключ не найдётся,
+прогон помечается как устаревший (перезапишите с --record).
+
+Кассета fixture/labels (FIXTURE_MODEL) — синтетическая: «модель» отвечает
+ровно по labels.yaml, пишется с --record без сети и ключей. Она проверяет
+сам стенд (ключи кассет, метрики, проигрыш задержек), а не качество модели.
+
+tiktoken качает BPE при первом вызове. Без сети укажите TIKTOKEN_CACHE_DIR
+с заранее скачанной кодировкой; если её нет — документ оценивается грубо
+(~4 символа на токен). Эта оценка идёт только в прогноз plan(): в отчёт
+и в ключи кассет она не попадает.
+
+Отчёт по стратегии × модели:
+  precision / recall по кодам в errors ответа (micro по корпусу),
+  LLM-вызовы, prompt/completion-токены,
+  симулированная латентность: записанные задержки проигрываются
+  с ускорением --time-scale, параллелизм стадий и семафор Yandex — как в
+  бою; стена делится обратно на масштаб.
+Документ, на котором analyze упал, не считается «всё найдено»: его
+ожидаемые коды идут в FN. Метрика без единого случая печатается как n/a.
+Код выхода 1 — если кассета устарела или хоть один документ упал.
+
+Как использовать:
+    cd /path/to/project/root
+    python scripts/bench_strategies.py --record --models default yandexgpt/latest   # нужна сеть и ключи
+    python scripts/bench_strategies.py --models default yandexgpt/latest           # офлайн
+    python scripts/bench_strategies.py --models fixture/labels                     # синтетика
+    python scripts/bench_strategies.py --record --models fixture/labels            # перезапись синтетики
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import yaml
+
+ROOT = Path(__file__).resolve().parents[1]
+BENCH_DIR = ROOT / "bench"
+
+# Чтобы Python нашёл пакет tz_expert, добавляем корень проекта в sys.path
+sys.path.append(str(ROOT))
+
+FIXTURE_MODEL = "fixture/labels"
+
+# проигрышу и синтетике ключи не нужны; при --record — настоящие из окружения / .env
+if "--record" not in sys.argv or FIXTURE_MODEL in sys.argv:
+    for var in ("OR_API_KEY", "OR_REFERER", "YC_API_KEY", "YC_FOLDER_ID"):
+        os.environ.setdefault(var, "bench")
+
+from tz_expert.schemas import AnalyzeRequest
+from tz_expert.services import llm_service
+from tz_expert.services.analyzer import (
+    AnalyzerService, _group_rules_message, _rule_text, model_key,
+)
+from tz_expert.services.llm_service import (
+    DEEP_SHAPE, TRIAGE_GROUP_SHAPE, LLMError, ask_llm, is_yandex_model,
+)
+from tz_expert.services.repository import YamlRuleRepository
+from tz_expert.settings import settings
+from tz_expert.utils import tokens
+from tz_expert.utils.payload import document_message
+
+
+STRATEGIES = ("group", "single")
+
+
+class CassetteMiss(LookupError):
+    """В кассете нет ответа на такой промпт (промпт или корпус поменялись)."""
+
+
+class Cassette:
+    """
+    Подменяет ask_llm (тот же вызов) для AnalyzerService(llm=...).
+    record=True — недостающие ответы берутся у source (настоящий ask_llm
+    или LabelFixture) и дописываются; уже записанные проигрываются.
+    """
+
+    def __init__(self, path: Path, record: bool = False, time_scale: float = 0.01,
+                 source=ask_llm):
+        self.path = path
+        self.record = record
+        self.time_scale = time_scale
+        self.source = source
+        self.misses = 0
+        self._dirty = False
+        self._entries: dict[str, dict] = (
+            json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        )
+
+    @staticmethod
+    def key(messages: list[dict], model: str | None) -> str:
+        payload = json.dumps(
+            [model_key(model), [[m["role"], m["content"]] for m in messages]],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def __call__(self, messages, model=None, *, stream=None, shape=None, on_item=None):
+        key = self.key(messages, model)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            if not self.record:
+                self.misses += 1
+                raise CassetteMiss(f"no recording for {model_key(model)} {key[:12]}")
+            t0 = time.perf_counter()
+            try:
+                obj, usage = await self.source(messages, model=model, stream=stream, shape=shape)
+            except LLMError as exc:
+                # брак формата после всех репромптов — поведение модели, пишем
+                entry = {"error": str(exc), "usage": dict(exc.usage or {})}
+            else:
+                entry = {"obj": obj, "usage": dict(usage)}
+            # ожидание семафора Yandex — не задержка модели: при проигрыше
+            # семафор отработает заново
+            queued = entry["usage"].pop("queue_seconds", 0.0)
+            entry["latency"] = round(time.perf_counter() - t0 - queued, 3)
+            self._entries[key] = entry
+            self._dirty = True
+            usage = dict(entry["usage"])
+        else:
+            # Yandex в бою пропускает не больше YC_MAX_CONCURRENCY вызовов разом
+            yandex = is_yandex_model(model)
+            slot = llm_service._YC_CONCURRENCY if yandex else contextlib.nullcontext()
+            t0 = time.perf_counter()
+            async with slot:
+                queued = time.perf_counter() - t0
+                await asyncio.sleep(entry["latency"] * self.time_scale)
+            usage = dict(entry.get("usage") or {})
+            if yandex:
+                usage["queue_seconds"] = queued     # как у ask_llm
+
+        if "error" in entry:
+            raise LLMError(entry["error"], usage=usage)
+        if on_item and shape and shape.items_key:
+            for item in entry["obj"].get(shape.items_key, []):
+                on_item(item)
+        return entry["obj"], usage
+
+    def save(self) -> None:
+        if self._dirty:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(
+                json.dumps(self._entries, ensure_ascii=False, indent=1, sort_keys=True),
+                encoding="utf-8",
+            )
+
+
+def _approx_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+class _ApproxEncoding:
+    """Замена tiktoken без BPE: ~4 символа на токен."""
+
+    def encode(self, text: str) -> range:
+        return range(_approx_tokens(text))
+
+
+def _offline_tokenizer() -> None:
+    """tiktoken без сети и без TIKTOKEN_CACHE_DIR → грубая оценка (см. шапку)."""
+    try:
+        tokens.warm_up(settings.llm_model)
+    except Exception as exc:
+        logging.warning("tiktoken недоступен (%s): токены документа оцениваются грубо, "
+                        "для точного прогноза задайте TIKTOKEN_CACHE_DIR", exc)
+        tokens._encoding = lambda model: _ApproxEncoding()
+        # воркеры process-пула подмену не увидят
+        settings.cpu_pool_kind = "inline"
+
+
+class LabelFixture:
+    """
+    Источник для кассеты FIXTURE_MODEL: отвечает ровно по labels.yaml
+    (triage — exists по expected, deep — одна находка). Задержки
+    синтетические: triage_seconds / deep_seconds на вызов.
+    """
+
+    def __init__(self, labels: dict, repo, triage_seconds: float = 0.2, deep_seconds: float = 0.8):
+        rules, groups_map = repo.get_all_rules(), repo.get_all_groups()
+        self.triage_seconds = triage_seconds
+        self.deep_seconds = deep_seconds
+        self._expected = {
+            document_message(_read_doc(doc["file"]))["content"]: set(doc["expected"])
+            for doc in labels["documents"]
+        }
+        # сообщение с правилами → коды, о которых спрашивают
+        self._codes = {_rule_text(rule): [code] for code, rule in rules.items()}
+        self._codes.update({
+            _group_rules_message(groups_map[g], rules)["content"]: groups_map[g]["codes"]
+            for g in labels["groups"]
+        })
+
+    async def __call__(self, messages, model=None, *, stream=None, shape=None, on_item=None):
+        expected = next(self._expected[m["content"]] for m in messages
+                        if m["content"] in self._expected)
+        codes = self._codes[messages[-1]["content"]]
+        if shape is TRIAGE_GROUP_SHAPE:
+            obj = {"results": [{"code": c, "exists": c in expected, "confidence": 0.9}
+                               for c in codes]}
+        elif shape is DEEP_SHAPE:
+            obj = {"code": codes[0], "title": "fixture", "findings": [
+                {"kind": "Missing", "paragraph": "num0000", "quote": "", "advice": "fixture"}]}
+        else:
+            obj = {"exists": codes[0] in expected, "confidence": 0.9}
+
+        await asyncio.sleep(self.deep_seconds if shape is DEEP_SHAPE else self.triage_seconds)
+        prompt = sum(_approx_tokens(m["content"]) for m in messages)
+        completion = _approx_tokens(json.dumps(obj, ensure_ascii=False))
+        return obj, {"prompt_tokens": prompt, "completion_tokens": completion,
+                     "total_tokens": prompt + completion}
+
+
+@dataclass
+class RunStats:
+    tp: int = 0
+    fp: int = 0
+    fn: int = 0
+    calls: int = 0
+    prompt: int = 0
+    completion: int = 0
+    seconds: float = 0.0        # симулированная стена, сумма по документам
+    failed: int = 0             # документов, где analyze упал (их expected — в fn)
+    missed: list[str] = field(default_factory=list)     # doc:code
+
+    @property
+    def precision(self) -> float | None:
+        return self.tp / (self.tp + self.fp) if self.tp + self.fp else None
+
+    @property
+    def recall(self) -> float | None:
+        return self.tp / (self.tp + self.fn) if self.tp + self.fn else None
+
+
+def _metric(value: float | None, width: int) -> str:
+    return f"{'n/a':>{width}s}" if value is None else f"{value:{width}.2f}"
+
+
+def _read_doc(name: str) -> str:
+    return (BENCH_DIR / "corpus" / name).read_text(encoding="utf-8")
+
+
+def _cassette_path(model: str | None) -> Path:
+    slug = model_key(model).replace("/", "_").replace(":", "_")
+    return BENCH_DIR / "cassettes" / f"{slug}.json"
+
+
+def _request(strategy: str, html: str, model: str | None, groups: list[str], codes: list[str]):
+    if strategy == "group":
+        return AnalyzeRequest(html=html, groups=groups, model=model)
+    return AnalyzeRequest(html=html, codes=codes, model=model)
+
+
+async def _run_one(svc, cassette, strategy, model, labels, groups, codes) -> RunStats:
+    stats = RunStats()
+    for doc in labels["documents"]:
+        html = _read_doc(doc["file"])
+        expected = set(doc["expected"])
+
+        t0 = time.perf_counter()
+        try:
+            resp = await svc.analyze(_request(strategy, html, model, groups, codes))
+        except Exception as exc:
+            logging.error("%s/%s %s: %s", strategy, model_key(model), doc["file"], exc)
+            stats.failed += 1
+            # ничего не нашли — значит, пропустили всё ожидаемое
+            stats.fn += len(expected)
+            stats.missed += [f"{doc['file']}:{c}" for c in sorted(expected)]
+            continue
+        stats.seconds += (time.perf_counter() - t0) / cassette.time_scale
+
+        found = {e.code for e in resp.errors} & set(codes)
+        stats.tp += len(found & expected)
+        stats.fp += len(found - expected)
+        stats.fn += len(expected - found)
+        stats.missed += [f"{doc['file']}:{c}" for c in sorted(expected - found)]
+        stats.calls += sum(su.calls for su in resp.stages.values())
+        stats.prompt += resp.tokens.prompt
+        stats.completion += resp.tokens.completion
+    return stats
+
+
+async def _run(args) -> int:
+    labels = yaml.safe_load((BENCH_DIR / "labels.yaml").read_text(encoding="utf-8"))
+    repo = YamlRuleRepository()
+    groups_map = repo.get_all_groups()
+    groups = labels["groups"]
+    codes = [c for g in groups for c in groups_map[g]["codes"]]
+    models = [None if m == "default" else m for m in args.models]
+    _offline_tokenizer()
+
+    rows, stale = [], False
+    for model in models:
+        # при записи задержки настоящие — и записанные проигрываем без ускорения
+        scale = 1.0 if args.record else args.time_scale
+        source = LabelFixture(labels, repo) if model == FIXTURE_MODEL else ask_llm
+        cassette = Cassette(_cassette_path(model), record=args.record, time_scale=scale,
+                            source=source)
+        svc = AnalyzerService(repo, llm=cassette)
+        for strategy in args.strategies:
+            rows.append((strategy, model_key(model), await _run_one(
+                svc, cassette, strategy, model, labels, groups, codes)))
+        cassette.save()
+        if cassette.misses:
+            stale = True
+            print(f"⚠ {cassette.path.name}: {cassette.misses} промптов без записи — "
+                  f"результаты по {model_key(model)} неполные, перезапишите с --record")
+
+    docs = len(labels["documents"])
+    print(f"corpus: {docs} docs, groups {', '.join(groups)} ({len(codes)} codes)")
+    print(f"{'strategy':8s} {'model':34s} {'prec':>5s} {'recall':>6s} {'calls':>6s} "
+          f"{'prompt':>8s} {'compl':>7s} {'sec/doc':>8s} {'failed':>6s}")
+    for strategy, model, st in rows:
+        print(f"{strategy:8s} {model:34s} {_metric(st.precision, 5)} {_metric(st.recall, 6)} "
+              f"{st.calls:6d} {st.prompt:8d} {st.completion:7d} {st.seconds / docs:8.1f} "
+              f"{st.failed:6d}")
+    if args.verbose:
+        for strategy, model, st in rows:
+            if st.missed:
+                print(f"missed by {strategy}/{model}: {', '.join(st.missed)}")
+    failed = sum(st.failed for _, _, st in rows)
+    if failed:
+        print(f"⚠ {failed} прогонов документов упали (см. лог) — их ожидаемые коды "
+              f"посчитаны пропущенными")
+    return 1 if stale or failed else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--models", nargs="+", default=["default"],
+                    help="как AnalyzeRequest.model; default — модель по умолчанию ask_llm")
+    ap.add_argument("--strategies", nargs="+", default=list(STRATEGIES), choices=STRATEGIES)
+    ap.add_argument("--record", action="store_true", help="дописать недостающие ответы (нужна сеть)")
+    ap.add_argument("--time-scale", type=float, default=0.01,
+                    help="ускорение проигрыша записанных задержек")
+    ap.add_argument("-v", "--verbose", action="store_true", help="какие коды пропущены")
+    sys.exit(asyncio.run(_run(ap.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
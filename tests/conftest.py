@@ -0,0 +1,139 @@
+"""
+Общие настройки тестов: ключи-заглушки для settings (сеть не нужна —
+провайдеры подменяются httpx.MockTransport или stub-LLM), корень проекта
+в sys.path, токенизатор без скачивания BPE и общие заглушки
+справочника (repo) и ask_llm (stub_llm).
+"""
+
+import os
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+for var in ("OR_API_KEY", "OR_REFERER", "YC_API_KEY", "YC_FOLDER_ID"):
+    os.environ.setdefault(var, "test")
+# пул процессов не видит monkeypatch — CPU-шаги считаем на месте
+os.environ.setdefault("CPU_POOL_KIND", "inline")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from tz_expert.services import llm_service  # noqa: E402
+
+
+class _WordEncoding:
+    """tiktoken без скачивания BPE: токен = слово."""
+
+    def encode(self, text: str) -> list[str]:
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def offline_tokenizer(monkeypatch):
+    from tz_expert.utils import tokens
+
+    monkeypatch.setattr(tokens, "_encoding", lambda model: _WordEncoding())
+    tokens._count_cache.clear()
+
+
+# ─── справочник правил ────────────────────────────────────────
+RULES = {
+    code: {"code": code, "title": f"title {code}", "description": "-", "detector": "-"}
+    for code in ("E02", "E03", "E04", "E05")
+}
+GROUPS = {
+    "G02": {"id": "G02", "name": "Заголовок", "system_prompt": "-", "codes": ["E02", "E03", "E04"]},
+    "G03": {"id": "G03", "name": "Предмет", "system_prompt": "-", "codes": ["E05"]},
+}
+
+
+class StubRepo:
+    """RuleRepository без БД."""
+
+    def get_all_rules(self):
+        return RULES
+
+    def get_all_groups(self):
+        return GROUPS
+
+
+@pytest.fixture
+def repo():
+    return StubRepo()
+
+
+# ─── ask_llm ──────────────────────────────────────────────────
+_DOC_ID_RE = re.compile(r'<DOCUMENT id="([^"]+)">')
+
+
+class StubLLM:
+    """
+    ask_llm без сети: ответ по system-промпту, запоминает (stage, model).
+
+    group_results — вердикты группового триажа; каждой группе (и каждому
+    документу пакета) отдаются только её коды. batch(ids, codes) — свой
+    ответ пакетного триажа; fail — {stage: исключение} для стадий
+    "group" / "batch" / "single" / "deep".
+    """
+
+    usage = {"prompt_tokens": 10, "completion_tokens": 2}
+
+    def __init__(self, group_results=(), single=None, batch=None, fail=None):
+        self.group_results = list(group_results)
+        self.single = single if single is not None else {"exists": False}
+        self.batch = batch
+        self.fail = fail or {}
+        self.calls: list[tuple[str, str | None]] = []
+
+    def _asked(self, messages) -> list[str]:
+        rules = messages[-1]["content"]
+        return [c for c in RULES if f"Код: {c}\n" in rules or f"'{c}'" in rules]
+
+    def _results(self, codes: list[str]) -> list[dict]:
+        return [r for r in self.group_results if r["code"] in codes]
+
+    async def __call__(self, messages, model=None, *, stream=None, shape=None, on_item=None):
+        stage = {
+            llm_service.TRIAGE_GROUP_SYSTEM: "group",
+            llm_service.TRIAGE_BATCH_SYSTEM: "batch",
+            llm_service.TRIAGE_SYSTEM: "single",
+        }.get(messages[0]["content"], "deep")
+        self.calls.append((stage, model))
+        if stage in self.fail:
+            raise self.fail[stage]
+
+        codes = self._asked(messages)
+        if stage == "group":
+            return {"results": self._results(codes)}, dict(self.usage)
+        if stage == "batch":
+            ids = [_DOC_ID_RE.match(m["content"]).group(1) for m in messages[1:-1]]
+            if self.batch is not None:
+                return self.batch(ids, codes), dict(self.usage)
+            return {"documents": [
+                {"id": i, "results": self._results(codes)} for i in ids
+            ]}, dict(self.usage)
+        if stage == "single":
+            return dict(self.single), dict(self.usage)
+        return {"code": codes[0], "title": "-", "findings": [
+            {"kind": "Invalid", "paragraph": "num0001", "quote": "-", "advice": "-"}
+        ]}, dict(self.usage)
+
+
+@pytest.fixture
+def stub_llm():
+    """Фабрика StubLLM: stub_llm(group_results=[...], single={...})."""
+    return StubLLM
+
+
+# ─── CPU-пул ──────────────────────────────────────────────────
+@pytest.fixture
+def thread_pool(monkeypatch):
+    """CPU_POOL_KIND=thread: monkeypatch виден воркерам, в отличие от process."""
+    from tz_expert.settings import settings
+    from tz_expert.utils import offload
+
+    offload.shutdown_pool()
+    monkeypatch.setattr(settings, "cpu_pool_kind", "thread")
+    yield offload
+    offload.shutdown_pool()
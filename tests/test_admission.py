@@ -0,0 +1,111 @@
+"""
+AdmissionController: очередь FIFO, таймаут ожидания, переполнение очереди.
+"""
+
+import asyncio
+
+import pytest
+
+from tz_expert.services.admission import AdmissionController, AdmissionRejected
+
+
+def _controller(**overrides) -> AdmissionController:
+    params = dict(max_tokens=100, max_calls=10, max_queue=4, max_wait=1.0, retry_after=7)
+    params.update(overrides)
+    return AdmissionController(**params)
+
+
+def test_queued_request_is_admitted_after_release():
+    async def _run():
+        ctl = _controller()
+        await ctl.acquire(80, 1)
+        waiter = asyncio.create_task(ctl.acquire(50, 1))
+        await asyncio.sleep(0)
+        queued = ctl.snapshot()
+
+        await ctl.release(80, 1)
+        await asyncio.wait_for(waiter, 1)
+        return queued, ctl.snapshot()
+
+    queued, admitted = asyncio.run(_run())
+    assert queued == {"tokens": 80, "calls": 1, "waiting": 1}
+    assert admitted == {"tokens": 50, "calls": 1, "waiting": 0}
+
+
+def test_small_request_does_not_overtake_queued_one():
+    async def _run():
+        ctl = _controller()
+        order = []
+
+        async def _acquire(name, tokens):
+            await ctl.acquire(tokens, 1)
+            order.append(name)
+
+        await ctl.acquire(80, 1)
+        big = asyncio.create_task(_acquire("big", 50))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(_acquire("small", 5))    # влез бы, но очередь не пуста
+        await asyncio.sleep(0.01)
+        before = list(order)
+
+        await ctl.release(80, 1)
+        await asyncio.wait_for(asyncio.gather(big, small), 1)
+        return before, order
+
+    before, order = asyncio.run(_run())
+    assert before == []
+    assert order == ["big", "small"]
+
+
+def test_queue_wait_timeout_unblocks_the_next_waiter():
+    async def _run():
+        ctl = _controller(max_wait=0.05)
+        await ctl.acquire(80, 1)
+        head = asyncio.create_task(ctl.acquire(50, 1))
+        await asyncio.sleep(0.03)                 # свой таймаут у behind — позже
+        behind = asyncio.create_task(ctl.acquire(5, 1))
+
+        with pytest.raises(AdmissionRejected, match="queue wait timeout") as exc:
+            await head
+        await asyncio.wait_for(behind, 1)
+        return exc.value, ctl.snapshot()
+
+    rejected, snapshot = asyncio.run(_run())
+    assert rejected.retry_after == 7
+    assert snapshot == {"tokens": 85, "calls": 2, "waiting": 0}
+
+
+def test_full_queue_rejects_at_once():
+    async def _run():
+        ctl = _controller(max_queue=1)
+        await ctl.acquire(100, 1)
+        waiter = asyncio.create_task(ctl.acquire(10, 1))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected, match="at capacity"):
+            await ctl.acquire(10, 1)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return ctl.snapshot()
+
+    assert asyncio.run(_run()) == {"tokens": 100, "calls": 1, "waiting": 0}
+
+
+def test_no_wait_rejects_without_queueing():
+    async def _run():
+        ctl = _controller(max_wait=0)
+        await ctl.acquire(90, 1)
+        with pytest.raises(AdmissionRejected, match="at capacity"):
+            await ctl.acquire(20, 1)
+        await ctl.acquire(10, 1)                 # влезает — пускаем сразу
+        return ctl.snapshot()
+
+    assert asyncio.run(_run()) == {"tokens": 100, "calls": 2, "waiting": 0}
+
+
+def test_idle_worker_admits_oversized_request():
+    async def _run():
+        ctl = _controller(max_wait=0)
+        await ctl.acquire(500, 1)
+        return ctl.snapshot()
+
+    assert asyncio.run(_run()) == {"tokens": 500, "calls": 1, "waiting": 0}
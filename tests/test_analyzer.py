@@ -0,0 +1,221 @@
+"""
+AnalyzerService: analyze / analyze_batch со stub-LLM
+(AnalyzerService(llm=...)) и прогноз plan() — без сети и БД.
+"""
+
+import asyncio
+
+import pytest
+
+from tz_expert.schemas import AnalyzeRequest, BatchAnalyzeRequest, BatchDocument, StageModels
+from tz_expert.services import llm_service
+from tz_expert.services.analyzer import AnalyzerService
+
+
+def _request() -> AnalyzeRequest:
+    return AnalyzeRequest(
+        html="<h1>ТЗ</h1>", groups=["G02"],
+        models=StageModels(triage_group="cheap/model", deep="strong/model"),
+    )
+
+
+@pytest.mark.parametrize("bad", ["high", "0.6", True, 1.5, -0.1, None, [0.5]])
+def test_non_numeric_confidence_is_ignored(bad, repo, stub_llm):
+    llm = stub_llm(
+        [{"code": "E02", "exists": True, "confidence": bad},
+         {"code": "E03", "exists": False, "confidence": bad},
+         {"code": "E04", "exists": False}],
+        single={"exists": True, "confidence": 0.9},
+    )
+    resp = asyncio.run(AnalyzerService(repo, llm=llm).analyze(_request()))
+
+    assert [e.code for e in resp.errors] == ["E02"]
+    assert ("single", "strong/model") not in llm.calls      # эскалаций нет
+
+
+def test_borderline_confidence_escalates(repo, stub_llm):
+    llm = stub_llm(
+        [{"code": "E02", "exists": True, "confidence": 0.95},
+         {"code": "E03", "exists": False, "confidence": 0.4},
+         {"code": "E04", "exists": False, "confidence": 1}],
+        single={"exists": True, "confidence": 0.9},
+    )
+    resp = asyncio.run(AnalyzerService(repo, llm=llm).analyze(_request()))
+
+    assert llm.calls.count(("single", "strong/model")) == 1
+    assert sorted(e.code for e in resp.errors) == ["E02", "E03"]
+
+
+def test_failed_call_tokens_are_counted(repo, stub_llm):
+    llm = stub_llm(fail={"single": llm_service.LLMError(
+        "Invalid JSON from LLM", usage={"prompt_tokens": 30, "completion_tokens": 6})})
+    req = AnalyzeRequest(html="<h1>ТЗ</h1>", codes=["E02"])
+    resp = asyncio.run(AnalyzerService(repo, llm=llm).analyze(req))
+
+    assert resp.errors == []
+    assert (resp.tokens.prompt, resp.tokens.completion) == (30, 6)
+    assert resp.stages["triage_single"].calls == 1
+
+
+def test_latency_excludes_yandex_queue(monkeypatch, repo):
+    """Ожидание семафора не попадает в латентность стадии (её умножают на волны)."""
+    from tz_expert.services import analyzer as analyzer_mod
+
+    recorded = []
+    monkeypatch.setattr(analyzer_mod.stage_stats, "record_call",
+                        lambda stage, model, latency, completion: recorded.append(latency))
+
+    async def _queued(messages, model=None, **kwargs):
+        await asyncio.sleep(0.05)
+        return {"exists": False}, {"prompt_tokens": 1, "completion_tokens": 1, "queue_seconds": 0.05}
+
+    req = AnalyzeRequest(html="<h1>ТЗ</h1>", codes=["E02"], model="yandexgpt/latest")
+    asyncio.run(AnalyzerService(repo, llm=_queued).analyze(req))
+
+    assert len(recorded) == 1 and recorded[0] < 0.04
+
+
+# ─── plan(): прогноз вызовов, токенов и секунд ────────────────
+@pytest.fixture
+def fresh_stats(monkeypatch):
+    """Пустая история: прогноз идёт по априорным значениям stats.py."""
+    from tz_expert.services import analyzer as analyzer_mod
+    from tz_expert.services.stats import StageStatistics
+
+    stats = StageStatistics()
+    monkeypatch.setattr(analyzer_mod, "stage_stats", stats)
+    return stats
+
+
+def test_plan_weights_optional_stages_by_probability(repo, fresh_stats):
+    from tz_expert.services import analyzer as analyzer_mod
+    from tz_expert.settings import settings
+
+    req = AnalyzeRequest(
+        html="<h1>ТЗ на поставку</h1>", groups=["G02"],
+        models=StageModels(triage_group="openrouter/cheap", deep="openrouter/strong"),
+    )
+    plan = asyncio.run(AnalyzerService(repo).plan(req))
+    group, esc, deep = (plan.stages[s] for s in ("triage_group", "escalation", "deep"))
+
+    overhead = analyzer_mod._overhead_tokens(analyzer_mod._triage_group_prompt(
+        analyzer_mod._EMPTY_DOC, repo.get_all_groups()["G02"], repo.get_all_rules()))
+    assert plan.doc_tokens == 3
+    assert (group.calls, group.prompt_tokens, group.seconds) == (1, 3 + overhead, 6.0)
+    assert group.completion_tokens == 60
+
+    p_esc, p_deep = fresh_stats.escalation_rate(), settings.admission_deep_ratio
+    assert esc.calls == pytest.approx(3 * p_esc)
+    assert esc.seconds == pytest.approx(3.0 * (1 - (1 - p_esc) ** 3))
+    assert deep.calls == pytest.approx(3 * p_deep)
+    assert deep.seconds == pytest.approx(20.0 * (1 - (1 - p_deep) ** 3))
+    assert deep.completion_tokens == round(3 * p_deep * 400)
+
+    assert plan.stages["triage_single"].seconds == 0.0
+    assert plan.calls == 3              # ceil(1 + 0.3 + 0.9)
+    assert plan.seconds == pytest.approx(group.seconds + esc.seconds + deep.seconds)
+
+
+def test_plan_counts_yandex_waves(repo, fresh_stats):
+    rules = {
+        f"E{n:02d}": {"code": f"E{n:02d}", "title": "-", "description": "-", "detector": "-"}
+        for n in range(1, 26)
+    }
+    svc = AnalyzerService(repo)
+
+    def _single(model):
+        req = AnalyzeRequest(html="<p>1</p>", codes=list(rules), model=model)
+        return asyncio.run(svc.plan(req, rules=rules, groups_map={})).stages["triage_single"]
+
+    yandex, openrouter = _single("yandexgpt/latest"), _single("openrouter/some")
+    assert yandex.calls == openrouter.calls == 25
+    assert yandex.seconds == 3 * 3.0           # 25 вызовов — 3 волны по YC_MAX_CONCURRENCY
+    assert openrouter.seconds == 3.0
+
+
+# ─── analyze_batch: упаковка группового триажа ────────────────
+NO_ERRORS = [{"code": c, "exists": False, "confidence": 0.9} for c in ("E02", "E03", "E04", "E05")]
+
+
+def _batch(*ids: str) -> BatchAnalyzeRequest:
+    return BatchAnalyzeRequest(
+        documents=[BatchDocument(id=i, html=f"<p>ТЗ {i}</p>") for i in ids],
+        groups=["G02", "G03"],
+    )
+
+
+def test_failed_packed_group_is_retried_alone(repo, stub_llm):
+    def _answer(ids, codes):
+        if codes == ["E05"]:
+            raise llm_service.LLMError("Invalid JSON from LLM")
+        return {"documents": [{"id": i, "results": NO_ERRORS[:3]} for i in ids]}
+
+    llm = stub_llm(NO_ERRORS, batch=_answer)
+    resp = asyncio.run(AnalyzerService(repo, llm=llm).analyze_batch(_batch("a", "b", "c")))
+
+    stages = [stage for stage, _ in llm.calls]
+    assert stages.count("batch") == 2
+    assert stages.count("group") == 3          # только G03, по документу; G02 уже принят
+    assert [d.errors for d in resp.documents] == [[], [], []]
+
+
+@pytest.mark.parametrize("sizes, budget, max_docs, bins", [
+    ([("a", 40), ("b", 40), ("c", 30)], 100, 8, [["a", "b"], ["c"]]),          # бюджет токенов
+    ([("a", 60), ("b", 60), ("c", 30)], 100, 8, [["a", "c"], ["b"]]),          # first-fit
+    ([(i, 1) for i in "abcde"], 100, 2, [["a", "b"], ["c", "d"], ["e"]]),      # лимит документов
+    ([("a", 10), ("big", 500), ("b", 10)], 100, 8, [["a", "b"], ["big"]]),     # крупнее бюджета
+])
+def test_pack_documents(sizes, budget, max_docs, bins):
+    from tz_expert.services.analyzer import _pack_documents
+
+    assert _pack_documents(sizes, budget, max_docs) == bins
+
+
+def test_packed_group_triage(repo, stub_llm):
+    def _answer(ids, codes):
+        return {"documents": [
+            {"id": i, "results": [{"code": c, "exists": (i, c) == ("b", "E05"), "confidence": 0.9}
+                                  for c in codes]}
+            for i in ids
+        ]}
+
+    llm = stub_llm(batch=_answer)
+    resp = asyncio.run(AnalyzerService(repo, llm=llm).analyze_batch(_batch("a", "b", "c")))
+
+    stages = [stage for stage, _ in llm.calls]
+    assert (stages.count("batch"), stages.count("group"), stages.count("deep")) == (2, 0, 1)
+    assert {d.id: [e.code for e in d.errors] for d in resp.documents} == {"a": [], "b": ["E05"], "c": []}
+    assert resp.stages["triage_group"].calls == 2
+    # 2 пакетных вызова + deep по b, по 10 + 2 токена (StubLLM.usage)
+    assert (resp.tokens.prompt, resp.tokens.completion) == (30, 6)
+
+
+def test_incomplete_or_foreign_packed_answer_falls_back(repo, stub_llm):
+    def _answer(ids, codes):
+        if codes == ["E05"]:
+            return {"documents": [{"id": i, "results": NO_ERRORS[3:]} for i in ids]}
+        return {"documents": [
+            {"id": "a", "results": NO_ERRORS[:2]},       # без E04 — неполный
+            {"id": "b", "results": NO_ERRORS[:3]},
+            {"id": "zzz", "results": NO_ERRORS[:3]},     # чужой id вместо c
+        ]}
+
+    llm = stub_llm(NO_ERRORS, batch=_answer)
+    resp = asyncio.run(AnalyzerService(repo, llm=llm).analyze_batch(_batch("a", "b", "c")))
+
+    stages = [stage for stage, _ in llm.calls]
+    assert (stages.count("batch"), stages.count("group")) == (2, 2)     # G02 для a и c
+    assert [d.id for d in resp.documents] == ["a", "b", "c"]
+    assert all(d.errors == [] for d in resp.documents)
+
+
+def test_documents_that_do_not_pack_are_triaged_alone(repo, stub_llm, monkeypatch):
+    from tz_expert.settings import settings
+
+    monkeypatch.setattr(settings, "batch_max_documents", 1)
+    llm = stub_llm(NO_ERRORS)
+    resp = asyncio.run(AnalyzerService(repo, llm=llm).analyze_batch(_batch("a", "b")))
+
+    stages = [stage for stage, _ in llm.calls]
+    assert (stages.count("batch"), stages.count("group")) == (0, 4)
+    assert "triage_group" not in resp.stages
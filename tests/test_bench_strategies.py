@@ -0,0 +1,61 @@
+"""
+scripts/bench_strategies.py: синтетическая кассета fixture/labels
+проигрывается без сети, упавшие документы не выдаются за «всё найдено».
+"""
+
+import asyncio
+import importlib.util
+from argparse import Namespace
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def bench():
+    path = Path(__file__).resolve().parents[1] / "scripts" / "bench_strategies.py"
+    spec = importlib.util.spec_from_file_location("bench_strategies", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _args(models, strategies):
+    return Namespace(models=models, strategies=strategies, record=False,
+                     time_scale=0.001, verbose=False)
+
+
+def test_fixture_cassette_replays(bench, capsys):
+    # промпты поменялись → кассета устарела:
+    # python scripts/bench_strategies.py --record --models fixture/labels
+    rc = asyncio.run(bench._run(_args([bench.FIXTURE_MODEL], list(bench.STRATEGIES))))
+    out = capsys.readouterr().out
+
+    assert rc == 0, out
+    assert "n/a" not in out and "⚠" not in out
+
+
+def test_failed_documents_count_as_missed(bench, tmp_path):
+    labels = bench.yaml.safe_load((bench.BENCH_DIR / "labels.yaml").read_text(encoding="utf-8"))
+    repo = bench.YamlRuleRepository()
+    groups = labels["groups"]
+    codes = [c for g in groups for c in repo.get_all_groups()[g]["codes"]]
+    cassette = bench.Cassette(tmp_path / "empty.json", time_scale=0.001)
+
+    stats = asyncio.run(bench._run_one(
+        bench.AnalyzerService(repo, llm=cassette), cassette, "group",
+        bench.FIXTURE_MODEL, labels, groups, codes))
+
+    expected = sum(len(d["expected"]) for d in labels["documents"])
+    assert stats.failed == len(labels["documents"])
+    assert (stats.tp, stats.fn, stats.recall, stats.precision) == (0, expected, 0.0, None)
+
+
+def test_failed_documents_fail_the_run(bench, monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(bench, "_cassette_path", lambda model: tmp_path / "empty.json")
+
+    rc = asyncio.run(bench._run(_args([bench.FIXTURE_MODEL], ["group"])))
+    out = capsys.readouterr().out
+
+    assert rc == 1
+    assert "n/a   0.00" in out
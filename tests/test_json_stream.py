@@ -0,0 +1,112 @@
+"""
+IncrementalJSONParser напрямую: форма, ранний обрыв, выдача элементов.
+"""
+
+import json
+
+import pytest
+
+from tz_expert.utils.json_stream import IncrementalJSONParser, JSONShape, JSONShapeError
+
+
+DEEP = JSONShape(frozenset({"code", "title", "findings"}), "findings")
+
+ANSWER = {
+    "code": "E04",
+    "title": "Скобки } ] { [ и \"кавычки\" в строке",
+    "findings": [
+        {"kind": "Invalid", "paragraph": "num0001", "quote": "п. 1 {см. [2]}", "advice": "-"},
+        {"kind": "Missing", "paragraph": "num0000", "quote": "", "advice": "a\\b"},
+    ],
+    "score": None,
+}
+
+
+def _feed_by(text: str, size: int, parser: IncrementalJSONParser) -> bool:
+    done = False
+    for i in range(0, len(text), size):
+        done = parser.feed(text[i:i + size])
+    return done
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_chunked_answer_parses_like_json_loads(size):
+    shape = DEEP._replace(keys=DEEP.keys | {"score"})
+    text = "```json\n" + json.dumps(ANSWER, ensure_ascii=False, indent=1) + "\n```"
+    parser = IncrementalJSONParser(shape)
+
+    assert _feed_by(text, size, parser)
+    assert parser.finish() == ANSWER
+
+
+def test_item_is_emitted_right_after_its_closing_brace():
+    text = json.dumps({"code": "E04", "title": "t", "findings": ANSWER["findings"]},
+                      ensure_ascii=False)
+    items, emitted_at = [], []
+    parser = IncrementalJSONParser(DEEP, on_item=items.append)
+    for i, ch in enumerate(text):
+        before = len(items)
+        parser.feed(ch)
+        if len(items) > before:
+            emitted_at.append(i)
+
+    # позиции закрывающих «}» самих находок, а не «}» внутри quote
+    ends = []
+    for f in ANSWER["findings"]:
+        item = json.dumps(f, ensure_ascii=False)
+        ends.append(text.index(item) + len(item) - 1)
+    assert items == ANSWER["findings"]
+    assert emitted_at == ends
+
+
+def test_preamble_limit():
+    with pytest.raises(JSONShapeError, match="no JSON object"):
+        IncrementalJSONParser(DEEP).feed("Конечно! " * 30 + "{}")
+
+    parser = IncrementalJSONParser(DEEP)
+    assert parser.feed("Вот ответ:\n" + '{"code": "E04"}')
+
+
+def test_unexpected_top_level_key():
+    with pytest.raises(JSONShapeError, match="unexpected key 'verdict'"):
+        IncrementalJSONParser(DEEP).feed('{"code": "E04", "verdict": ')
+
+
+def test_findings_must_be_an_array():
+    with pytest.raises(JSONShapeError, match="must be an array"):
+        IncrementalJSONParser(DEEP).feed('{"code": "E04", "findings": {')
+
+
+@pytest.mark.parametrize("prefix", [
+    '{"code":"E01" "title":"t"',          # пропущена «,»
+    '{"code" "E01", "title": "t"',        # пропущено «:»
+    '{"code": E01, "title": "t"',         # голое слово
+    '{"code": abc',
+    '{"findings": [{"kind": "Invalid"} {"kind": "Missing"}',
+    '{"code": "E01",, "title": "t"',
+    '{"code": "E01", }',
+    '{"findings": [1, ]',
+    '{"code": "E01": "t"',
+    '{"code": "E01", "title": tru',       # литерал оборван разделителем ниже
+])
+def test_syntax_error_aborts_before_root_closes(prefix):
+    parser = IncrementalJSONParser()
+    with pytest.raises(JSONShapeError):
+        parser.feed(prefix)
+        parser.feed(" ,")
+    assert not parser.done
+
+
+def test_scalars_and_empty_containers_are_accepted():
+    text = '{"a": -1.5e3, "b": [true, false, null, 0], "c": {}, "d": [], "e": [[{}]]}'
+    parser = IncrementalJSONParser()
+
+    assert _feed_by(text, 2, parser)
+    assert parser.finish() == json.loads(text)
+
+
+def test_unfinished_stream():
+    parser = IncrementalJSONParser(DEEP)
+    parser.feed('{"code": "E04", "findings": [')
+    with pytest.raises(JSONShapeError, match="before JSON object was closed"):
+        parser.finish()
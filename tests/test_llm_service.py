@@ -0,0 +1,222 @@
+"""
+ask_llm против httpx.MockTransport: OpenRouter / Yandex × обычный / стриминговый
+ответ, плюс репромпт после оборванного стрима.
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from tz_expert.services import llm_service
+from tz_expert.services.llm_service import ask_llm, TRIAGE_SHAPE
+
+
+MESSAGES = [{"role": "user", "content": "<DOCUMENT>ТЗ</DOCUMENT>"}]
+ANSWER = '{"exists": true, "confidence": 0.9}'
+
+
+class _ChunkStream(httpx.AsyncByteStream):
+    """Тело ответа по кускам; помнит, закрыли ли его."""
+
+    def __init__(self, chunks: list[str]):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aiter__(self):
+        for c in self.chunks:
+            yield c.encode("utf-8")
+
+    async def aclose(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """
+    Подменяет оба клиента; handler(request, body) -> httpx.Response.
+    Возвращает список разобранных тел запросов.
+    """
+    seen: list[dict] = []
+
+    def install(handler):
+        def _handle(request: httpx.Request) -> httpx.Response:
+            body = json.loads(request.content)
+            seen.append(body)
+            return handler(request, body)
+
+        transport = httpx.MockTransport(_handle)
+        monkeypatch.setattr(llm_service, "or_client", httpx.AsyncClient(
+            base_url=llm_service.or_client.base_url, transport=transport))
+        monkeypatch.setattr(llm_service, "yc_client", httpx.AsyncClient(
+            base_url=llm_service.yc_client.base_url, transport=transport))
+        return seen
+
+    return install
+
+
+def _or_sse(text: str, usage: dict | None) -> list[str]:
+    lines = [
+        ": OPENROUTER PROCESSING\n\n",
+        *(f"data: {json.dumps({'choices': [{'delta': {'content': ch}}]})}\n\n" for ch in text),
+    ]
+    if usage:
+        lines.append(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+    lines.append("data: [DONE]\n\n")
+    return lines
+
+
+def _yc_ndjson(text: str, usage: dict) -> list[str]:
+    # Yandex присылает накопленный текст, а не дельты
+    return [
+        json.dumps({"result": {
+            "alternatives": [{"message": {"role": "assistant", "text": text[:i]}}],
+            **({"usage": usage} if i == len(text) else {}),
+        }}) + "\n"
+        for i in range(4, len(text) + 1, 4)
+    ] + ([json.dumps({"result": {
+        "alternatives": [{"message": {"role": "assistant", "text": text}}],
+        "usage": usage,
+    }}) + "\n"] if len(text) % 4 else [])
+
+
+def _tokens(usage: dict) -> dict:
+    """usage без queue_seconds (ожидание семафора Yandex)."""
+    return {k: v for k, v in usage.items() if k != "queue_seconds"}
+
+
+OR_USAGE = {"prompt_tokens": 11, "completion_tokens": 7, "total_tokens": 18}
+YC_USAGE = {"inputTextTokens": "11", "completionTokens": "7", "totalTokens": "18"}
+
+
+def test_openrouter_plain(provider):
+    seen = provider(lambda req, body: httpx.Response(200, json={
+        "choices": [{"message": {"role": "assistant", "content": ANSWER}}],
+        "usage": OR_USAGE,
+    }))
+    obj, usage = asyncio.run(ask_llm(MESSAGES, stream=False))
+
+    assert obj == {"exists": True, "confidence": 0.9}
+    assert usage["prompt_tokens"] == 11 and usage["completion_tokens"] == 7
+    assert seen[0]["model"] == llm_service.DEFAULT_MODEL
+    assert seen[0]["messages"] == MESSAGES
+
+
+def test_openrouter_stream(provider):
+    stream = _ChunkStream(_or_sse(ANSWER, OR_USAGE))
+    seen = provider(lambda req, body: httpx.Response(200, stream=stream))
+    obj, usage = asyncio.run(ask_llm(MESSAGES, stream=True, shape=TRIAGE_SHAPE))
+
+    assert obj == {"exists": True, "confidence": 0.9}
+    assert usage == OR_USAGE
+    assert seen[0]["stream"] is True
+    assert stream.closed
+
+
+def test_yandex_plain(provider):
+    seen = provider(lambda req, body: httpx.Response(200, json={"result": {
+        "alternatives": [{"message": {"role": "assistant", "text": ANSWER}}],
+        "usage": YC_USAGE,
+    }}))
+    obj, usage = asyncio.run(ask_llm(MESSAGES, "yandexgpt/latest", stream=False))
+
+    assert obj == {"exists": True, "confidence": 0.9}
+    assert _tokens(usage) == {"prompt_tokens": 11, "completion_tokens": 7, "total_tokens": 18}
+    assert seen[0]["modelUri"] == f"gpt://{llm_service.settings.yc_folder_id}/yandexgpt/latest"
+    assert seen[0]["messages"] == [{"role": "user", "text": MESSAGES[0]["content"]}]
+    assert "completionOptions" not in seen[0]
+
+
+def test_yandex_stream(provider):
+    stream = _ChunkStream(_yc_ndjson(ANSWER, YC_USAGE))
+    seen = provider(lambda req, body: httpx.Response(200, stream=stream))
+    obj, usage = asyncio.run(ask_llm(MESSAGES, "yandexgpt/latest", stream=True, shape=TRIAGE_SHAPE))
+
+    assert obj == {"exists": True, "confidence": 0.9}
+    assert _tokens(usage) == {"prompt_tokens": 11, "completion_tokens": 7, "total_tokens": 18}
+    assert seen[0]["completionOptions"] == {"stream": True}
+    assert "stream" not in seen[0]["generationOptions"]
+    assert stream.closed
+
+
+def test_yandex_stream_aborts_and_reprompts(provider):
+    """Ответ не той формы обрывается, поток закрывается, идёт fix-промпт."""
+    streams = [
+        _ChunkStream(_yc_ndjson('{"verdict": "yes", "exists": true}', YC_USAGE)),
+        _ChunkStream(_yc_ndjson(ANSWER, YC_USAGE)),
+    ]
+    seen = provider(lambda req, body: httpx.Response(200, stream=streams[len(seen) - 1]))
+    obj, _ = asyncio.run(ask_llm(MESSAGES, "yandexgpt/latest", stream=True, shape=TRIAGE_SHAPE))
+
+    assert obj == {"exists": True, "confidence": 0.9}
+    assert len(seen) == 2
+    assert seen[1]["messages"][-1]["text"] == llm_service._FIX_MESSAGE["content"]
+    assert all(s.closed for s in streams)
+
+
+def test_aborted_stream_usage_is_counted(provider):
+    """Токены оборванной попытки (оценка) прибавляются к usage успешной."""
+    streams = [
+        _ChunkStream(_or_sse('{"verdict": "yes"}', OR_USAGE)),
+        _ChunkStream(_or_sse(ANSWER, OR_USAGE)),
+    ]
+    seen = provider(lambda req, body: httpx.Response(200, stream=streams[len(seen) - 1]))
+    _, usage = asyncio.run(ask_llm(MESSAGES, stream=True, shape=TRIAGE_SHAPE))
+
+    # conftest: токен = слово; стрим оборван на ключе "verdict"
+    approx_prompt = len(MESSAGES[0]["content"].split())
+    assert len(seen) == 2
+    assert usage["prompt_tokens"] == OR_USAGE["prompt_tokens"] + approx_prompt
+    assert usage["completion_tokens"] > OR_USAGE["completion_tokens"]
+
+
+def test_failed_retries_carry_usage(provider):
+    provider(lambda req, body: httpx.Response(200, json={"result": {
+        "alternatives": [{"message": {"role": "assistant", "text": "{not json"}}],
+        "usage": YC_USAGE,
+    }}))
+    with pytest.raises(llm_service.LLMError, match="Invalid JSON") as info:
+        asyncio.run(ask_llm(MESSAGES, "yandexgpt/latest", stream=False))
+
+    # 1 попытка + 2 репромпта, все оплачены
+    assert _tokens(info.value.usage) == {"prompt_tokens": 33, "completion_tokens": 21, "total_tokens": 54}
+
+
+@pytest.mark.parametrize("frame", [
+    '{"error": {"grpcCode": 8, "message": "quota exceeded"}}\n',
+    "<html>502 Bad Gateway</html>\n",
+])
+def test_yandex_stream_error_frame(provider, frame):
+    stream = _ChunkStream([frame])
+    provider(lambda req, body: httpx.Response(200, stream=stream))
+    with pytest.raises(RuntimeError, match="YC stream") as info:
+        asyncio.run(ask_llm(MESSAGES, "yandexgpt/latest", stream=True, shape=TRIAGE_SHAPE))
+
+    assert not isinstance(info.value, llm_service.LLMError)    # не репромпт
+    assert stream.closed
+
+
+def test_yandex_reports_queue_wait(provider, monkeypatch):
+    monkeypatch.setattr(llm_service, "_YC_CONCURRENCY", asyncio.Semaphore(1))
+
+    async def _handle(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"result": {
+            "alternatives": [{"message": {"role": "assistant", "text": ANSWER}}],
+            "usage": YC_USAGE,
+        }})
+
+    class _Slow(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            return await _handle(request)
+
+    monkeypatch.setattr(llm_service, "yc_client", httpx.AsyncClient(
+        base_url=llm_service.yc_client.base_url, transport=_Slow()))
+
+    async def _two():
+        return await asyncio.gather(*(
+            ask_llm(MESSAGES, "yandexgpt/latest", stream=False) for _ in range(2)))
+
+    waits = sorted(usage["queue_seconds"] for _, usage in asyncio.run(_two()))
+    assert waits[0] < 0.01 and waits[1] >= 0.04
@@ -0,0 +1,60 @@
+"""
+run_cpu: inline / thread пул и ограничение числа задач в пуле.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from tz_expert.settings import settings
+from tz_expert.utils import offload
+
+
+def _thread_name(x: int) -> tuple[int, str]:
+    return x * 2, threading.current_thread().name
+
+
+def test_inline_runs_in_the_loop_thread():
+    offload.shutdown_pool()
+    assert settings.cpu_pool_kind == "inline"
+
+    assert asyncio.run(offload.run_cpu(_thread_name, 21)) == (42, threading.current_thread().name)
+    assert offload.get_executor() is None
+
+
+def test_thread_pool_runs_off_the_loop(thread_pool):
+    value, name = asyncio.run(thread_pool.run_cpu(_thread_name, 21))
+
+    assert value == 42
+    assert name.startswith("cpu")
+
+
+def test_pending_tasks_are_bounded(thread_pool, monkeypatch):
+    monkeypatch.setattr(settings, "cpu_pool_workers", 4)
+    lock = threading.Lock()
+    running, peak = 0, 0
+
+    def _work(_):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+
+    async def _run():
+        monkeypatch.setattr(thread_pool, "_slots", asyncio.Semaphore(2))
+        await asyncio.gather(*(thread_pool.run_cpu(_work, i) for i in range(6)))
+
+    asyncio.run(_run())
+    assert peak == 2
+
+
+def test_unknown_pool_kind(monkeypatch):
+    offload.shutdown_pool()
+    monkeypatch.setattr(settings, "cpu_pool_kind", "fork")
+    with pytest.raises(ValueError, match="Unknown CPU_POOL_KIND"):
+        offload.get_executor()
@@ -0,0 +1,132 @@
+"""
+Роутеры: бюджет admission возвращается при любом исходе ответа
+/analyze/stream, 503 / 422 до анализа, итоги /estimate.
+"""
+
+import asyncio
+import json
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+from tz_expert.app import main, routers
+from tz_expert.services import analyzer
+from tz_expert.services.admission import admission
+
+
+def test_stream_releases_budget_when_never_started():
+    """Клиент ушёл до http.response.start — генератор не стартует, бюджет всё равно возвращается."""
+    started = False
+
+    async def _events():
+        nonlocal started
+        started = True
+        yield "{}\n"
+
+    async def _send(message):
+        raise OSError("client disconnected")
+
+    async def _receive():
+        return {"type": "http.disconnect"}
+
+    async def _run():
+        await admission.acquire(1000, 3)
+        response = routers._AdmittedStream(_events(), 1000, 3, media_type="application/x-ndjson")
+        try:
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, _receive, _send)
+        except ClientDisconnect:
+            pass
+        return admission.snapshot()
+
+    assert asyncio.run(_run()) == {"tokens": 0, "calls": 0, "waiting": 0}
+    assert not started
+
+
+def test_stream_result_and_release(monkeypatch, repo, stub_llm):
+    monkeypatch.setattr(analyzer, "ask_llm", stub_llm())
+    main.app.dependency_overrides[routers.get_repo] = lambda: repo
+    try:
+        with TestClient(main.app) as client:
+            r = client.post("/analyze/stream", json={"html": "<h1>ТЗ</h1>"})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    events = [json.loads(line) for line in r.text.splitlines()]
+    assert r.status_code == 200
+    assert events[-1]["type"] == "result" and events[-1]["errors"] == []
+    assert admission.snapshot() == {"tokens": 0, "calls": 0, "waiting": 0}
+
+
+def test_batch_rejects_unsafe_document_id(repo):
+    main.app.dependency_overrides[routers.get_repo] = lambda: repo
+    try:
+        with TestClient(main.app) as client:
+            r = client.post("/analyze/batch", json={"documents": [
+                {"id": 'a">x', "html": "<p>1</p>"},
+                {"id": "b", "html": "<p>2</p>"},
+            ]})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert r.status_code == 422
+
+
+def test_overloaded_worker_gets_retry_after(monkeypatch, repo):
+    monkeypatch.setattr(admission, "max_wait", 0)
+    main.app.dependency_overrides[routers.get_repo] = lambda: repo
+    try:
+        with TestClient(main.app) as client:
+            asyncio.run(admission.acquire(admission.max_tokens, 1))   # бюджет исчерпан
+            try:
+                for path in ("/analyze", "/analyze/stream"):
+                    r = client.post(path, json={"html": "<h1>ТЗ</h1>"})
+                    assert r.status_code == 503
+                    assert r.headers["Retry-After"] == str(admission.retry_after)
+            finally:
+                asyncio.run(admission.release(admission.max_tokens, 1))
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_unknown_codes_and_groups_are_422(repo):
+    main.app.dependency_overrides[routers.get_repo] = lambda: repo
+    try:
+        with TestClient(main.app) as client:
+            responses = [
+                client.post(path, json=body) for path, body in (
+                    ("/estimate", {"html": "<p>1</p>", "codes": ["NOPE"]}),
+                    ("/analyze", {"html": "<p>1</p>", "codes": ["E02", "NOPE"], "groups": ["G99"]}),
+                    ("/analyze/stream", {"html": "<p>1</p>", "groups": ["G99"]}),
+                    ("/analyze/batch", {"documents": [{"id": "a", "html": "<p>1</p>"}],
+                                        "codes": ["NOPE"]}),
+                )
+            ]
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert [r.status_code for r in responses] == [422] * 4
+    assert "NOPE" in responses[0].json()["detail"]
+    assert "NOPE" in responses[1].json()["detail"] and "G99" in responses[1].json()["detail"]
+    assert "E02" not in responses[1].json()["detail"]
+    assert admission.snapshot() == {"tokens": 0, "calls": 0, "waiting": 0}
+
+
+def test_estimate_totals_match_stages(repo):
+    main.app.dependency_overrides[routers.get_repo] = lambda: repo
+    try:
+        with TestClient(main.app) as client:
+            r = client.post("/estimate", json={"html": "<p>1 2 3</p>", "codes": ["E02", "E03"]})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    body = r.json()
+    stages = body["stages"]
+    assert r.status_code == 200
+    assert body["doc_tokens"] == 3
+    assert stages["triage_group"]["calls"] == 0 and stages["triage_group"]["seconds"] == 0
+    assert stages["triage_single"]["calls"] == 2
+    assert body["calls"] == math.ceil(sum(s["calls"] for s in stages.values()))
+    assert body["prompt_tokens"] == sum(s["prompt_tokens"] for s in stages.values())
+    assert body["seconds"] == pytest.approx(sum(s["seconds"] for s in stages.values()), abs=0.2)
@@ -0,0 +1,94 @@
+"""
+Подсчёт токенов: кэш по хэшу текста (LRU) и общая задача для
+одновременных запросов одного документа.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from tz_expert.settings import settings
+from tz_expert.utils import tokens
+
+
+class _CountingEncoding:
+    """Токен = слово; считает вызовы encode (из любого потока)."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def encode(self, text: str) -> list[str]:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return text.split()
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    enc = _CountingEncoding()
+    monkeypatch.setattr(tokens, "_encoding", lambda model: enc)
+    return enc
+
+
+def test_count_is_memoized_by_text_hash(encoding):
+    assert tokens.count_tokens_cached("раз два три") == 3
+    assert tokens.count_tokens_cached("раз два три") == 3
+    assert asyncio.run(tokens.count_tokens_async("раз два три")) == 3
+    assert encoding.calls == 1
+
+    assert tokens.count_tokens_cached("раз два") == 2
+    assert encoding.calls == 2
+    assert (settings.llm_model, tokens.text_hash("раз два три")) in tokens._count_cache
+
+
+def test_cache_evicts_least_recently_used(encoding, monkeypatch):
+    monkeypatch.setattr(tokens, "_COUNT_CACHE_SIZE", 2)
+    for text in ("a", "b", "a", "c"):                 # «a» освежён — вытесняется «b»
+        tokens.count_tokens_cached(text)
+    assert encoding.calls == 3
+
+    tokens.count_tokens_cached("a")
+    assert encoding.calls == 3
+    tokens.count_tokens_cached("b")
+    assert encoding.calls == 4
+    assert len(tokens._count_cache) == 2
+
+
+@pytest.fixture
+def offloaded(monkeypatch, thread_pool):
+    """Любой текст — в пул (порог в 1 символ), encode медленный."""
+    enc = _CountingEncoding(delay=0.05)
+    monkeypatch.setattr(tokens, "_encoding", lambda model: enc)
+    monkeypatch.setattr(settings, "cpu_offload_min_chars", 1)
+    return enc
+
+
+def test_concurrent_callers_share_one_task(offloaded):
+    async def _run():
+        counts = await asyncio.gather(*(tokens.count_tokens_async("один два") for _ in range(3)))
+        return counts, dict(tokens._in_flight)
+
+    counts, in_flight = asyncio.run(_run())
+    assert counts == [2, 2, 2]
+    assert offloaded.calls == 1
+    assert in_flight == {}
+    assert tokens.count_tokens_cached("один два") == 2 and offloaded.calls == 1
+
+
+def test_cancelled_waiter_does_not_cancel_shared_task(offloaded):
+    async def _run():
+        first = asyncio.create_task(tokens.count_tokens_async("один два три"))
+        second = asyncio.create_task(tokens.count_tokens_async("один два три"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(_run()) == (3, True)
+    assert offloaded.calls == 1
+    assert tokens._in_flight == {}
+    assert (settings.llm_model, tokens.text_hash("один два три")) in tokens._count_cache
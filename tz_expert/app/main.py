@@ -4,9 +4,22 @@ main.py
 FastAPI-приложение 
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from .routers import router
+from tz_expert.services.loop_lag import loop_lag
+from tz_expert.utils.offload import start_pool, shutdown_pool
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # пул для tiktoken / разбора JSON поднимаем до первого запроса
+    await start_pool()
+    loop_lag.start()
+    yield
+    await loop_lag.stop()
+    shutdown_pool()
 
 
 app = FastAPI(
@@ -16,7 +29,8 @@ app = FastAPI(
     openapi_tags=[
         {"name": "Rules", "description": "Работа со справочником правил"},
         {"name": "Analysis", "description": "Проверка и анализ документов"}
-    ]
+    ],
+    lifespan=lifespan,
 )
 
-app.include_router(router)
\ No newline at end of file
+app.include_router(router)
@@ -1,10 +1,36 @@
-from fastapi import APIRouter, Body, Depends
-from tz_expert.schemas import AnalyzeRequest, AnalyzeResponse
-from tz_expert.services.analyzer import AnalyzerService
+import json
+import asyncio
+
+from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from tz_expert.schemas import (
+    AnalyzeRequest, AnalyzeResponse,
+    BatchAnalyzeRequest, BatchAnalyzeResponse,
+    EstimateResponse, StageEstimate,
+)
+from tz_expert.services.admission import admission, AdmissionRejected
+from tz_expert.services.analyzer import AnalyzerService, UnknownRules, model_key
 from tz_expert.services.repository import RuleRepository
 
 router = APIRouter(tags=["Analysis"])
 
+def _overloaded(exc: AdmissionRejected) -> HTTPException:
+    """503 + Retry-After для запроса, не прошедшего admission control."""
+    return HTTPException(
+        status_code=503,
+        detail=f"Сервис перегружен: {exc}",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def _planned(plan):
+    """plan() / plan_batch(): неизвестные codes/groups → 422 с их списком."""
+    try:
+        return await plan
+    except UnknownRules as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+
+
 def get_repo() -> RuleRepository:
     """FastAPI dependency – даёт свежий Repo на каждый запрос."""
     return RuleRepository()
@@ -21,6 +47,7 @@ async def list_rules(repo: RuleRepository = Depends(get_repo)):
     summary="LLM-анализ ТЗ",
     response_description="Найдённые ошибки и статистика токенов",
     tags=["Analysis"],
+    responses={503: {"description": "Воркер перегружен, повторите после Retry-After"}},
 )
 async def analyze(
     req: AnalyzeRequest = Body(
@@ -47,4 +74,160 @@ async def analyze(
     Используйте `codes` **или** `groups`. Если оба списка пусты — берутся
     все группы по умолчанию.
     """
-    return await svc.analyze(req)
+    plan = await _planned(svc.plan(req))
+    try:
+        async with admission.admit(plan.total_tokens, plan.calls):
+            return await svc.analyze(req, plan=plan)
+    except AdmissionRejected as exc:
+        raise _overloaded(exc) from exc
+
+
+@router.post(
+    "/analyze/batch",
+    response_model=BatchAnalyzeResponse,
+    summary="LLM-анализ пакета коротких ТЗ",
+    response_description="Результаты по каждому документу и общая статистика токенов",
+    tags=["Analysis"],
+    responses={503: {"description": "Воркер перегружен, повторите после Retry-After"}},
+)
+async def analyze_batch(
+    req: BatchAnalyzeRequest = Body(...),
+    repo: RuleRepository = Depends(get_repo),
+):
+    """
+    Для архивов коротких ТЗ (1–3 страницы): групповой триаж нескольких
+    документов упаковывается в один вызов на группу (с автоматическим
+    разбиением по `BATCH_MAX_PROMPT_TOKENS`), deep — по каждому документу.
+    Параметры `codes` / `groups` / `model` / `models` — как в `/analyze`.
+    """
+    ids = [d.id for d in req.documents]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=422, detail="id документов должны быть уникальны")
+
+    svc = AnalyzerService(repo)
+    # бюджет — по сумме одиночных планов (упаковка его только уменьшает)
+    plans = await _planned(svc.plan_batch(req))
+    try:
+        async with admission.admit(
+            sum(p.total_tokens for p in plans.values()),
+            sum(p.calls for p in plans.values()),
+        ):
+            return await svc.analyze_batch(req, plans=plans)
+    except AdmissionRejected as exc:
+        raise _overloaded(exc) from exc
+
+
+def _ndjson(obj: dict) -> str:
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+
+class _AdmittedStream(StreamingResponse):
+    """
+    StreamingResponse, занявший бюджет admission до ответа (чтобы успеть
+    отдать 503). Бюджет возвращается здесь, а не в генераторе: если клиент
+    ушёл до первого байта, Starlette генератор даже не запускает.
+    """
+
+    def __init__(self, content, tokens: int, calls: int, **kwargs):
+        super().__init__(content, **kwargs)
+        self._budget = (tokens, calls)
+
+    async def _finish(self) -> None:
+        await self.body_iterator.aclose()       # отменит анализ, если он идёт
+        await admission.release(*self._budget)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # отмена задачи ответа не должна оборвать возврат бюджета
+            await asyncio.shield(self._finish())
+
+
+@router.post(
+    "/analyze/stream",
+    summary="LLM-анализ ТЗ с потоковой выдачей находок",
+    response_description="NDJSON: события finding по мере готовности, затем result",
+    tags=["Analysis"],
+    responses={503: {"description": "Воркер перегружен, повторите после Retry-After"}},
+)
+async def analyze_stream(
+    req: AnalyzeRequest = Body(...),
+    repo: RuleRepository = Depends(get_repo),
+):
+    """
+    То же, что `/analyze`, но ответ — поток NDJSON:
+
+    * `{"type": "finding", "code": ..., "finding": {...}}` — как только
+      deep-ответ LLM содержит очередную находку;
+    * `{"type": "result", "errors": [...], "tokens": {...}}` — итог
+      (источник истины, как ответ `/analyze`);
+    * `{"type": "error", "detail": ...}` — если анализ упал.
+    """
+    svc  = AnalyzerService(repo)
+    plan = await _planned(svc.plan(req))
+    try:
+        await admission.acquire(plan.total_tokens, plan.calls)
+    except AdmissionRejected as exc:
+        raise _overloaded(exc) from exc
+
+    async def _events():
+        queue: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(svc.analyze(
+            req, plan=plan,
+            on_finding=lambda code, f: queue.put_nowait((code, f)),
+        ))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (item := await queue.get()) is not None:
+                code, finding = item
+                yield _ndjson({"type": "finding", "code": code, "finding": finding.model_dump()})
+            try:
+                result = task.result()
+            except Exception as exc:
+                yield _ndjson({"type": "error", "detail": str(exc)})
+            else:
+                yield _ndjson({"type": "result", **result.model_dump()})
+        finally:
+            task.cancel()                  # клиент отвалился — не тратим токены
+
+    return _AdmittedStream(
+        _events(), plan.total_tokens, plan.calls, media_type="application/x-ndjson",
+    )
+
+
+@router.post(
+    "/estimate",
+    response_model=EstimateResponse,
+    summary="Оценка стоимости анализа без вызова LLM",
+    response_description="Ожидаемые вызовы, токены и длительность по стадиям",
+    tags=["Analysis"],
+)
+async def estimate(
+    req: AnalyzeRequest = Body(...),
+    repo: RuleRepository = Depends(get_repo),
+):
+    """
+    Dry-run `/analyze`: то же планирование `codes`/`groups`, но без
+    обращения к провайдерам. Число deep-вызовов прогнозируется по
+    истории положительных вердиктов триажа, эскалаций — по доле
+    пограничных вердиктов, секунды — по латентности стадий и их моделей.
+    """
+    plan = await _planned(AnalyzerService(repo).plan(req))
+    return EstimateResponse(
+        doc_tokens=plan.doc_tokens,
+        calls=plan.calls,
+        prompt_tokens=plan.prompt_tokens,
+        completion_tokens=plan.completion_tokens,
+        seconds=round(plan.seconds, 1),
+        stages={
+            name: StageEstimate(
+                model=model_key(st.model),
+                calls=round(st.calls, 2),
+                prompt_tokens=st.prompt_tokens,
+                completion_tokens=st.completion_tokens,
+                seconds=round(st.seconds, 1),
+            )
+            for name, st in plan.stages.items()
+        },
+    )
@@ -4,10 +4,20 @@ schemas.py
 Pydantic-DTO: строгая валидация входа/выхода.
 """
 
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel, Field, ConfigDict 
 
 # ---------- ВХОД ----------
+class StageModels(BaseModel):
+    """Модели по стадиям каскада; None — берётся model / настройки."""
+    triage_group: Optional[str] = Field(None, description="Дешёвая модель группового триажа")
+    triage_single: Optional[str] = Field(None, description="Модель одиночного триажа по codes")
+    deep: Optional[str] = Field(None, description="Сильная модель детального отчёта")
+    escalation: Optional[str] = Field(
+        None, description="Модель для пограничных вердиктов триажа; по умолчанию — deep"
+    )
+
+
 class AnalyzeRequest(BaseModel):
     html: str = Field(..., description="Документ в HTML")
     codes: Optional[List[str]] = Field(
@@ -24,6 +34,10 @@ class AnalyzeRequest(BaseModel):
         ),
         examples=["gpt-4o-mini", "gpt-4o", "anyscale/mistral-8x22b​​​​​"]
     )
+    models: Optional[StageModels] = Field(
+        None,
+        description="Модели по стадиям (triage_group / triage_single / deep / escalation); перекрывают model",
+    )
 
     # ⬇️   Дефолтный объект для всего запроса ─────────────────
     model_config = ConfigDict(
@@ -39,6 +53,28 @@ class AnalyzeRequest(BaseModel):
         }
     )
 
+class BatchDocument(BaseModel):
+    id: str = Field(
+        ...,
+        pattern=r"^[A-Za-z0-9_.:-]{1,64}$",   # попадает в <DOCUMENT id="…"> промпта
+        description="Идентификатор документа (вернётся в ответе): латиница, цифры, _ . : -",
+    )
+    html: str = Field(..., description="Документ в HTML")
+
+
+class BatchAnalyzeRequest(BaseModel):
+    documents: List[BatchDocument] = Field(..., min_length=1)
+    codes: Optional[List[str]] = Field(None, description="Как в /analyze — для каждого документа")
+    groups: Optional[List[str]] = Field(None, description="Как в /analyze — для каждого документа")
+    model: Optional[str] = Field(None, description="Как в /analyze")
+    models: Optional[StageModels] = Field(None, description="Как в /analyze")
+
+    def for_document(self, doc: BatchDocument) -> AnalyzeRequest:
+        return AnalyzeRequest(
+            html=doc.html, codes=self.codes, groups=self.groups,
+            model=self.model, models=self.models,
+        )
+
 # ---------- ВЫХОД ----------
 class Finding(BaseModel):
     kind: str                   # "Invalid" | "Missing"
@@ -61,7 +97,40 @@ class TokenStat(BaseModel):
     completion: int
     total: int
 
+class StageUsage(BaseModel):
+    model: str
+    calls: int = 0
+    prompt: int = 0
+    completion: int = 0
+    seconds: float = 0.0       # время стадии по стене (вызовы идут параллельно)
+
 class AnalyzeResponse(BaseModel):
     errors: List[AnalyzeOut]
-    tokens: TokenStat          
+    tokens: TokenStat
+    stages: Dict[str, StageUsage] = Field(default_factory=dict)
+
+# ---------- ПАКЕТ (/analyze/batch) ----------
+class BatchDocumentResult(AnalyzeResponse):
+    id: str                    # tokens/stages — только вызовы этого документа
+
+class BatchAnalyzeResponse(BaseModel):
+    documents: List[BatchDocumentResult]
+    tokens: TokenStat          # всего, включая общий упакованный триаж
+    stages: Dict[str, StageUsage] = Field(default_factory=dict)   # общие (упакованные) вызовы
+
+
+# ---------- ОЦЕНКА (/estimate) ----------
+class StageEstimate(BaseModel):
+    model: str
+    calls: float               # для escalation/deep — ожидаемое число по истории
+    prompt_tokens: int
+    completion_tokens: int
+    seconds: float
 
+class EstimateResponse(BaseModel):
+    doc_tokens: int
+    calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    seconds: float             # грубый прогноз длительности /analyze
+    stages: Dict[str, StageEstimate]
@@ -0,0 +1,126 @@
+"""
+admission.py
+------------
+Admission control: ограничиваем бюджет токенов и LLM-вызовов,
+которые один воркер держит «в полёте».
+
+Стоимость запроса оценивается заранее (см. AnalyzerService.plan).
+Если бюджета не хватает — запрос ждёт в ограниченной очереди
+не дольше admission_max_wait секунд, после чего получает отказ
+(роутер превращает его в 503 + Retry-After).
+
+Очередь честная (FIFO): пока кто-то ждёт, новый запрос встаёт в хвост,
+даже если сам влез бы в бюджет, — иначе поток мелких запросов
+бесконечно обгонял бы крупный документ до таймаута.
+"""
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+from tz_expert.settings import settings
+
+
+class AdmissionRejected(RuntimeError):
+    """Бюджет воркера исчерпан — запрос не принят."""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Счётчик бюджета «в полёте» для одного процесса-воркера."""
+
+    def __init__(
+        self,
+        max_tokens: int,
+        max_calls: int,
+        max_queue: int,
+        max_wait: float,
+        retry_after: int,
+    ):
+        self.max_tokens  = max_tokens
+        self.max_calls   = max_calls
+        self.max_queue   = max_queue
+        self.max_wait    = max_wait
+        self.retry_after = retry_after
+
+        self._tokens = 0
+        self._calls  = 0
+        self._queue: deque[object] = deque()     # билеты ожидающих, по порядку прихода
+        self._cond = asyncio.Condition()
+
+    def _fits(self, tokens: int, calls: int) -> bool:
+        # пустой воркер принимает любой запрос — иначе документ
+        # крупнее лимита не прошёл бы никогда
+        if self._tokens == 0 and self._calls == 0:
+            return True
+        return (
+            self._tokens + tokens <= self.max_tokens and
+            self._calls + calls <= self.max_calls
+        )
+
+    def snapshot(self) -> dict:
+        """Текущая загрузка воркера (для логов/метрик)."""
+        return {
+            "tokens":  self._tokens,
+            "calls":   self._calls,
+            "waiting": len(self._queue),
+        }
+
+    async def acquire(self, tokens: int, calls: int) -> None:
+        """Занять бюджет (ждать в очереди) или бросить AdmissionRejected."""
+        async with self._cond:
+            if self._queue or not self._fits(tokens, calls):
+                if self.max_wait <= 0 or len(self._queue) >= self.max_queue:
+                    raise AdmissionRejected(self.retry_after, "worker is at capacity")
+
+                ticket = object()
+                self._queue.append(ticket)
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(
+                            lambda: self._queue[0] is ticket and self._fits(tokens, calls)
+                        ),
+                        self.max_wait,
+                    )
+                except asyncio.TimeoutError:
+                    raise AdmissionRejected(
+                        self.retry_after, "queue wait timeout"
+                    ) from None
+                finally:
+                    self._queue.remove(ticket)
+                    # первым в очереди стал следующий — пусть проверит бюджет
+                    self._cond.notify_all()
+
+            self._tokens += tokens
+            self._calls  += calls
+
+    async def release(self, tokens: int, calls: int) -> None:
+        async with self._cond:
+            self._tokens -= tokens
+            self._calls  -= calls
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def admit(self, tokens: int, calls: int):
+        """
+        async with admission.admit(tokens, calls):
+            ...  # запрос выполняется в рамках бюджета
+        """
+        await self.acquire(tokens, calls)
+        try:
+            yield
+        finally:
+            await self.release(tokens, calls)
+
+
+# ─── единственный контроллер на процесс ───────────────────────
+admission = AdmissionController(
+    max_tokens=settings.admission_max_tokens,
+    max_calls=settings.admission_max_calls,
+    max_queue=settings.admission_max_queue,
+    max_wait=settings.admission_max_wait,
+    retry_after=settings.admission_retry_after,
+)
@@ -1,63 +1,84 @@
 """
 analyzer.py  
-Orchestration layer: triage-group → triage-single → deep.
+Orchestration layer: triage-group → triage-single → escalation → deep.
+Каждая стадия может идти своей моделью (дешёвый триаж, сильный deep).
 """
 
 import json
+import math
+import time
 import asyncio
 import logging
-from typing import List, Dict, Tuple
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Dict, Tuple
 
 from tz_expert.schemas import (
     AnalyzeRequest, AnalyzeResponse,
-    AnalyzeOut, Finding, TokenStat
+    AnalyzeOut, Finding, TokenStat,
+    StageModels, StageUsage,
+    BatchAnalyzeRequest, BatchAnalyzeResponse, BatchDocumentResult,
 )
 from tz_expert.services.llm_service import (
-    ask_llm, LLMError,
-    TRIAGE_SYSTEM, TRIAGE_GROUP_SYSTEM, DEEP_SYSTEM
+    ask_llm, LLMError, is_yandex_model, payload_flavor,
+    DEFAULT_MODEL, YC_MAX_CONCURRENCY,
+    TRIAGE_SYSTEM, TRIAGE_GROUP_SYSTEM, DEEP_SYSTEM, TRIAGE_BATCH_SYSTEM,
+    TRIAGE_SHAPE, TRIAGE_GROUP_SHAPE, DEEP_SHAPE, TRIAGE_BATCH_SHAPE,
 )
-from tz_expert.utils.tokens import count_tokens
+from tz_expert.utils.json_stream import JSONShape
+from tz_expert.utils.payload import EncodedMessage, document_message, prepare_document
+from tz_expert.utils.tokens import count_tokens_async, count_tokens_cached
 from tz_expert.services.repository import RuleRepository
+from tz_expert.services.stats import stage_stats
+from tz_expert.settings import settings
 
 
+# ---------- PROMPT-генераторы ----------
+# system-промпты общие для всех запросов — JSON кодируется один раз на процесс
+_TRIAGE_SYSTEM_MSG       = EncodedMessage("system", TRIAGE_SYSTEM)
+_TRIAGE_GROUP_SYSTEM_MSG = EncodedMessage("system", TRIAGE_GROUP_SYSTEM)
+_TRIAGE_BATCH_SYSTEM_MSG = EncodedMessage("system", TRIAGE_BATCH_SYSTEM)
+_DEEP_SYSTEM_MSG         = EncodedMessage("system", DEEP_SYSTEM)
+
+# пустой документ — для оценки «накладных» токенов промпта в plan()
+_EMPTY_DOC = document_message("")
+
+# ---- обязательные поля в findings + репромпт deep при их отсутствии ----
+_DEEP_REQUIRED = {"kind", "paragraph", "quote", "advice"}
+_DEEP_REPAIR_MSG = EncodedMessage(
+    "user",
+    "‼️ Формат ответа нарушен: "
+    f"отсутствуют ключи {_DEEP_REQUIRED}. "
+    "Верни ровно JSON указанного формата.",
+)
 
 
-# ---------- PROMPT-генераторы ----------
-def _triage_prompt(html: str, rule: dict) -> List[dict]:
+def _rule_text(rule: dict) -> str:
+    return (
+        f"'Код ошибки' : '{rule['code']}',\n"
+        f"'Название ошибки' : '{rule['title']}',\n"
+        f"'Описание ошибки' : '{rule['description']}',\n"
+        f"'Способ обнаружения ошибки' : '{rule['detector']}'"
+    )
+
+
+# doc — сообщение из document_message(): строится один раз на запрос
+def _triage_prompt(doc: dict, rule: dict) -> List[dict]:
     return [
-        {"role": "system", "content": TRIAGE_SYSTEM},
-        {"role": "user",   "content": f"<DOCUMENT>{html}</DOCUMENT>"},
-        {"role": "user",   "content":
-            f"'Код ошибки' : '{rule['code']}',\n"
-            f"'Название ошибки' : '{rule['title']}',\n"
-            f"'Описание ошибки' : '{rule['description']}',\n"
-            f"'Способ обнаружения ошибки' : '{rule['detector']}'"
-        }
+        _TRIAGE_SYSTEM_MSG,
+        doc,
+        {"role": "user", "content": _rule_text(rule)},
     ]
 
 
-def _deep_prompt(html: str, rule: dict) -> List[dict]:
+def _deep_prompt(doc: dict, rule: dict) -> List[dict]:
     return [
-        {"role": "system", "content": DEEP_SYSTEM},
-        {"role": "user",   "content": f"<DOCUMENT>{html}</DOCUMENT>"},
-        {"role": "user",   "content":
-            f"'Код ошибки' : '{rule['code']}',\n"
-            f"'Название ошибки' : '{rule['title']}',\n"
-            f"'Описание ошибки' : '{rule['description']}',\n"
-            f"'Способ обнаружения ошибки' : '{rule['detector']}'"
-        }
+        _DEEP_SYSTEM_MSG,
+        doc,
+        {"role": "user", "content": _rule_text(rule)},
     ]
 
 
-def _triage_group_prompt(
-    html: str,
-    group_def: dict,
-    rules: Dict[str, dict]
-) -> List[dict]:
-    """
-    group_def["system_prompt"] теперь — это описание группы из БД.
-    rules — полный словарь {code → rule}.
-    """
+def _group_rules_message(group_def: dict, rules: Dict[str, dict]) -> dict:
     # Формируем тело из всех кодов группы
     body = "\n\n".join(
         f"Код: {rules[code]['code']}\n"
@@ -66,71 +87,425 @@ def _triage_group_prompt(
         f"Детектор: {rules[code]['detector']}"
         for code in group_def["codes"]
     )
+    return {"role": "user", "content": group_def["system_prompt"] + body + "\n\n Верни ровно JSON"}
+
+
+def _triage_group_prompt(
+    doc: dict,
+    group_def: dict,
+    rules: Dict[str, dict]
+) -> List[dict]:
+    """
+    group_def["system_prompt"] теперь — это описание группы из БД.
+    rules — полный словарь {code → rule}.
+    """
+    return [
+        _TRIAGE_GROUP_SYSTEM_MSG,
+        doc,
+        _group_rules_message(group_def, rules),
+    ]
+
 
+def _triage_batch_prompt(
+    docs: List[dict],
+    group_def: dict,
+    rules: Dict[str, dict]
+) -> List[dict]:
+    """
+    Пакетный вариант _triage_group_prompt: несколько коротких документов
+    (document_message(html, id)) делят один system-промпт и один текст
+    правил группы.
+    """
     return [
-        {"role": "system",  "content": TRIAGE_GROUP_SYSTEM},
-        {"role": "user",    "content": f"<DOCUMENT>{html}</DOCUMENT>"},
-        {"role": "user",    "content": group_def["system_prompt"] + body + "\n\n Верни ровно JSON"},
+        _TRIAGE_BATCH_SYSTEM_MSG,
+        *docs,
+        _group_rules_message(group_def, rules),
     ]
 
 
+def _confidence(verdict: dict) -> float | None:
+    """
+    confidence из ответа триажа. Схему без стриминга никто не проверяет —
+    «high», "0.6", true или 1.5 считаем отсутствующей уверенностью.
+    """
+    value = verdict.get("confidence")
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value) if 0.0 <= value <= 1.0 else None
+
+
+def _pack_documents(
+    sizes: List[Tuple[str, int]],
+    budget: int,
+    max_docs: int,
+) -> List[List[str]]:
+    """
+    First-fit по порядку: документы (id, токены) раскладываются в пакеты,
+    чтобы сумма токенов ≤ budget и документов ≤ max_docs.
+    Документ крупнее budget получает пакет из одного себя.
+    """
+    bins: List[List[str]] = []
+    used: List[int] = []
+    for doc_id, tokens in sizes:
+        for i, ids in enumerate(bins):
+            if len(ids) < max_docs and used[i] + tokens <= budget:
+                ids.append(doc_id)
+                used[i] += tokens
+                break
+        else:
+            bins.append([doc_id])
+            used.append(tokens)
+    return bins
+
+
+def _overhead_tokens(messages: List[dict]) -> int:
+    """Токены промпта без самого документа (system + правила)."""
+    return sum(count_tokens_cached(m["content"]) for m in messages)
+
+
+def _stage_seconds(stage: str, st: "StagePlan") -> float:
+    """
+    Вызовы стадии идут параллельно; для Yandex — волнами по семафору.
+    escalation/deep могут не случиться вовсе — латентность стадии
+    взвешивается вероятностью хотя бы одного вызова.
+    """
+    if st.calls <= 0:
+        return 0.0
+    waves = math.ceil(st.calls / YC_MAX_CONCURRENCY) if is_yandex_model(st.model) else 1
+    return stage_stats.latency(stage, model_key(st.model)) * waves * (1 - st.idle)
+
+
+def model_key(model: str | None) -> str:
+    """Имя модели для статистики/ответа: None → дефолт ask_llm."""
+    return model or DEFAULT_MODEL
+
+
+def _resolve_models(req: AnalyzeRequest) -> Dict[str, str | None]:
+    """
+    Модель каждой стадии каскада:
+    req.models.<stage> → req.model → settings.llm_model_<stage> → None (дефолт ask_llm).
+    escalation по умолчанию — модель deep.
+    """
+    per_stage = req.models or StageModels()
+    configured = {
+        "triage_group":  settings.llm_model_triage_group,
+        "triage_single": settings.llm_model_triage_single,
+        "deep":          settings.llm_model_deep,
+    }
+    models = {
+        stage: getattr(per_stage, stage) or req.model or default
+        for stage, default in configured.items()
+    }
+    models["escalation"] = (
+        per_stage.escalation or settings.llm_model_escalation or models["deep"]
+    )
+    return models
+
+
+# ---------- План запроса ----------
+class UnknownRules(LookupError):
+    """В запросе codes/groups, которых нет в справочнике."""
+
+    def __init__(self, codes: List[str], groups: List[str]):
+        parts = []
+        if codes:
+            parts.append(f"неизвестные коды: {', '.join(codes)}")
+        if groups:
+            parts.append(f"неизвестные группы: {', '.join(groups)}")
+        super().__init__("; ".join(parts))
+        self.codes  = codes
+        self.groups = groups
+
+
+# стадии идут последовательно в этом порядке
+STAGES = ("triage_group", "triage_single", "escalation", "deep")
+
+
+@dataclass
+class StagePlan:
+    model:             str | None = None
+    calls:             float = 0     # для escalation/deep — ожидаемое (дробное) число
+    prompt_tokens:     int   = 0
+    completion_tokens: int   = 0
+    seconds:           float = 0.0
+    idle:              float = 1.0   # вероятность, что стадия не сделает ни одного вызова
+
+    def expect(self, p: float = 1.0) -> None:
+        """Ещё один вызов с вероятностью p (триаж — наверняка)."""
+        self.calls += p
+        self.idle  *= 1 - p
+
+
+@dataclass
+class AnalysisPlan:
+    """
+    Что будет проверено и во что это обойдётся — оценка до вызова LLM.
+    Используется admission control'ом, /estimate и самим analyze
+    (без повторного похода в БД).
+    """
+    rules:      Dict[str, dict]
+    groups_map: Dict[str, dict]
+    groups:     List[str]
+    codes:      List[str]
+    doc_tokens: int
+    stages: Dict[str, StagePlan] = field(
+        default_factory=lambda: {s: StagePlan() for s in STAGES})
+
+    @property
+    def models(self) -> Dict[str, str | None]:
+        return {name: st.model for name, st in self.stages.items()}
+
+    def escalates(self, stage: str) -> bool:
+        """Эскалация имеет смысл, только если модель действительно сильнее."""
+        return model_key(self.stages[stage].model) != model_key(self.stages["escalation"].model)
+
+    @property
+    def calls(self) -> int:
+        return math.ceil(sum(st.calls for st in self.stages.values()))
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(st.prompt_tokens for st in self.stages.values())
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(st.completion_tokens for st in self.stages.values())
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def seconds(self) -> float:
+        return sum(st.seconds for st in self.stages.values())
+
+
 # ---------- Сервис-класс ----------
 class AnalyzerService:
     
-    def __init__(self, repo: RuleRepository | None = None):
+    def __init__(
+        self,
+        repo: RuleRepository | None = None,
+        llm: Callable[..., Awaitable[Tuple[dict, dict]]] | None = None,
+    ):
         # позволяет передавать репозиторий через Depends
         self._repo = repo or RuleRepository()
+        # llm — с сигнатурой ask_llm; подмена для офлайн-прогонов (кассеты)
+        self._llm = llm or ask_llm
+
+    async def plan(
+        self,
+        req: AnalyzeRequest,
+        rules: Dict[str, dict] | None = None,
+        groups_map: Dict[str, dict] | None = None,
+    ) -> AnalysisPlan:
+        """
+        Разрешаем codes/groups и модели стадий, оцениваем число вызовов,
+        токенов и секунд: triage-group + triage-single + эскалации +
+        ожидаемый fan-out deep.
+        Провайдеров не вызывает — только токенизация (в пуле) и статистика.
+        rules/groups_map можно передать готовыми (пакет — один поход в БД).
+        Неизвестные codes/groups → UnknownRules (роутер отвечает 422).
+        """
+        rules      = rules if rules is not None else self._repo.get_all_rules()
+        groups_map = groups_map if groups_map is not None else self._repo.get_all_groups()
 
-    async def analyze(self, req: AnalyzeRequest) -> AnalyzeResponse:
-        model = req.model
-
-        # ---- теперь пользуемся self._repo ------------
-        RULES       = self._repo.get_all_rules()
-        GROUPS_MAP  = self._repo.get_all_groups()
-        DEFAULT_GROUPS = list(GROUPS_MAP.keys())
-
-        # 2) Коды и группы из запроса
         codes  = req.codes  or []
         groups = req.groups or []
         if not codes and not groups:
-            groups = DEFAULT_GROUPS
+            groups = list(groups_map.keys())
+        unknown_codes  = [c for c in codes if c not in rules]
+        unknown_groups = [g for g in groups if g not in groups_map]
+        if unknown_codes or unknown_groups:
+            raise UnknownRules(unknown_codes, unknown_groups)
+
+        plan = AnalysisPlan(
+            rules=rules, groups_map=groups_map,
+            groups=groups, codes=codes,
+            doc_tokens=await count_tokens_async(req.html),
+        )
+        for stage, model in _resolve_models(req).items():
+            plan.stages[stage].model = model
+        doc = plan.doc_tokens
+
+        # --- triage ---
+        candidates: List[str] = []
+        escalatable: List[str] = []
+        st = plan.stages["triage_group"]
+        for grp_id in groups:
+            grp = groups_map[grp_id]
+            st.expect()
+            st.prompt_tokens += doc + _overhead_tokens(_triage_group_prompt(_EMPTY_DOC, grp, rules))
+            candidates.extend(grp["codes"])
+            if plan.escalates("triage_group"):
+                escalatable.extend(grp["codes"])
+
+        st = plan.stages["triage_single"]
+        for code in codes:
+            st.expect()
+            st.prompt_tokens += doc + _overhead_tokens(_triage_prompt(_EMPTY_DOC, rules[code]))
+            candidates.append(code)
+            if plan.escalates("triage_single"):
+                escalatable.append(code)
+
+        # --- эскалация пограничных вердиктов (одиночный триаж) ---
+        st = plan.stages["escalation"]
+        for code in escalatable:
+            p = stage_stats.escalation_rate()
+            st.expect(p)
+            st.prompt_tokens += round(p * (doc + _overhead_tokens(_triage_prompt(_EMPTY_DOC, rules[code]))))
+
+        # --- deep: ожидаемое число позитивов по истории триажа ---
+        st = plan.stages["deep"]
+        for code in candidates:
+            p = stage_stats.positive_rate(code)
+            st.expect(p)
+            st.prompt_tokens += round(p * (doc + _overhead_tokens(_deep_prompt(_EMPTY_DOC, rules[code]))))
+
+        for name, st in plan.stages.items():
+            st.completion_tokens = round(
+                st.calls * stage_stats.completion(name, model_key(st.model)))
+            st.seconds = _stage_seconds(name, st)
+        return plan
+
+    async def analyze(
+        self,
+        req: AnalyzeRequest,
+        plan: AnalysisPlan | None = None,
+        on_finding: Callable[[str, Finding], None] | None = None,
+        group_verdicts: Dict[str, List[Tuple[str, bool, float | None]]] | None = None,
+    ) -> AnalyzeResponse:
+        """
+        on_finding(code, finding) — вызывается для каждой находки deep
+        сразу по мере стриминга ответа (см. /analyze/stream).
+        Итоговый AnalyzeResponse остаётся источником истины.
+
+        group_verdicts — {grp_id: вердикты}, уже полученные пакетным
+        триажем (analyze_batch); triage_group вызывается только для
+        остальных групп.
+        """
+        plan   = plan or await self.plan(req)
+        models = plan.models
+
+        RULES      = plan.rules
+        GROUPS_MAP = plan.groups_map
+        codes      = plan.codes
+        groups     = plan.groups
+
+        # документ: f-строка и JSON — один раз на весь запрос (JSON — в пуле)
+        doc = await prepare_document(req.html, map(payload_flavor, models.values()))
 
         token_stat = {"prompt": 0, "completion": 0}
-        triage_pairs: List[Tuple[str, bool]] = []
+        stage_stat = {
+            s: StageUsage(model=model_key(models[s])) for s in STAGES
+        }
+        triage: List[Tuple[str, bool, float | None]] = []   # code, exists, confidence
+
+        async def _ask(
+            stage: str,
+            prompt: List[dict],
+            shape: JSONShape,
+            on_item: Callable[[dict], None] | None = None,
+        ) -> dict:
+            """
+            ask_llm моделью стадии + накопление usage + статистика для /estimate.
+            Токены неудачного вызова (LLMError.usage) тоже учитываются.
+            """
+            t0 = time.perf_counter()
+            try:
+                obj, usage = await self._llm(
+                    prompt, model=models[stage], shape=shape, on_item=on_item)
+            except LLMError as exc:
+                if exc.usage:
+                    _account(stage, exc.usage, t0)
+                raise
+            _account(stage, usage, t0)
+            return obj
+
+        def _account(stage: str, usage: dict, t0: float) -> None:
+            prompt_tokens     = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+            token_stat["prompt"]     += prompt_tokens
+            token_stat["completion"] += completion_tokens
+
+            su = stage_stat[stage]
+            su.calls += 1
+            su.prompt += prompt_tokens
+            su.completion += completion_tokens
+            # ожидание семафора Yandex — не латентность модели: волны
+            # по семафору прогноз учитывает сам (_stage_seconds)
+            latency = time.perf_counter() - t0 - usage.get("queue_seconds", 0.0)
+            stage_stats.record_call(stage, su.model, latency, completion_tokens)
+
+        async def _run_stage(stage: str, coros) -> list:
+            """Вызовы стадии — параллельно; время стадии — по стене."""
+            t0 = time.perf_counter()
+            results = await asyncio.gather(*coros)
+            stage_stat[stage].seconds = round(time.perf_counter() - t0, 3)
+            return results
 
         # --- group triage ---
-        async def _triage_group(grp_id: str) -> List[Tuple[str, bool]]:
-            obj, usage = await ask_llm(
-                _triage_group_prompt(req.html, GROUPS_MAP[grp_id], RULES),
-                model=model,
+        async def _triage_group(grp_id: str) -> List[Tuple[str, bool, float | None]]:
+            obj = await _ask(
+                "triage_group",
+                _triage_group_prompt(doc, GROUPS_MAP[grp_id], RULES),
+                TRIAGE_GROUP_SHAPE,
             )
-            token_stat["prompt"]     += usage.get("prompt_tokens", 0)
-            token_stat["completion"] += usage.get("completion_tokens", 0)
-            return [(r["code"], r["exists"]) for r in obj["results"]]
+            return [(r["code"], r["exists"], _confidence(r)) for r in obj["results"]]
 
-        if groups:
-            tasks = (_triage_group(g) for g in groups)
-            results = await asyncio.gather(*tasks)
-            triage_pairs.extend(p for sub in results for p in sub)
+        by_group = dict(group_verdicts or {})
+        pending = [g for g in groups if g not in by_group]
+        if pending:
+            results = await _run_stage("triage_group", (_triage_group(g) for g in pending))
+            by_group.update(zip(pending, results))
+        triage.extend(p for g in groups for p in by_group[g])
 
         # --- single triage ---
-        async def _triage_single(code: str) -> Tuple[str, bool]:
+        async def _triage_single(code: str) -> Tuple[str, bool, float | None]:
             rule = RULES[code]
             try:
-                obj, usage = await ask_llm(
-                    _triage_prompt(req.html, rule),
-                    model=model,
-                )
-                token_stat["prompt"]     += usage.get("prompt_tokens", 0)
-                token_stat["completion"] += usage.get("completion_tokens", 0)
-                return code, obj.get("exists", False)
+                obj = await _ask("triage_single", _triage_prompt(doc, rule), TRIAGE_SHAPE)
+                return code, obj.get("exists", False), _confidence(obj)
             except Exception as exc:
                 logging.error("LLM triage error %s: %s", code, exc)
-                return code, False
+                return code, False, None
 
         if codes:
-            tasks = (_triage_single(c) for c in codes)
-            triage_pairs.extend(await asyncio.gather(*tasks))
+            triage.extend(await _run_stage(
+                "triage_single", (_triage_single(c) for c in codes)))
+
+        # --- escalation: пограничные вердикты → сильная модель ---
+        stage_of = {c: "triage_group" for g in groups for c in GROUPS_MAP[g]["codes"]}
+        stage_of.update({c: "triage_single" for c in codes})
+        escalatable = [
+            (c, conf) for c, _, conf in triage
+            if plan.escalates(stage_of.get(c, "triage_group"))
+        ]
+        borderline = [
+            c for c, conf in escalatable
+            if conf is not None and conf < settings.escalation_threshold
+        ]
+
+        async def _escalate(code: str) -> Tuple[str, bool | None]:
+            # сбой эскалации не должен менять вердикт дешёвой модели
+            try:
+                obj = await _ask("escalation", _triage_prompt(doc, RULES[code]), TRIAGE_SHAPE)
+                return code, obj.get("exists", False)
+            except Exception as exc:
+                logging.error("LLM escalation error %s: %s", code, exc)
+                return code, None
+
+        if borderline:
+            escalated = dict(await _run_stage("escalation", (_escalate(c) for c in borderline)))
+            triage = [
+                (c, ok if escalated.get(c) is None else escalated[c], conf)
+                for c, ok, conf in triage
+            ]
+        if escalatable:
+            stage_stats.record_escalations(len(borderline), len(escalatable))
+
+        triage_pairs = [(c, ok) for c, ok, _ in triage]
+        stage_stats.record_verdicts(triage_pairs)
 
         positives = [c for c, ok in triage_pairs if ok]
 
@@ -142,16 +517,7 @@ class AnalyzerService:
             • Если даже после 3-й попытки формат плохой – пишем заглушку.
             """
             rule = RULES[code]
-
-            async def _call(prompt: list[dict]):
-                """Обёртка над ask_llm с накоплением usage."""
-                obj, usage = await ask_llm(prompt, model=model)
-                token_stat["prompt"]     += usage.get("prompt_tokens", 0)
-                token_stat["completion"] += usage.get("completion_tokens", 0)
-                return obj
-
-            # ---- обязательные поля в findings ----
-            required = {"kind", "paragraph", "quote", "advice"}
+            required = _DEEP_REQUIRED
 
             def _is_valid(o: dict) -> bool:
                 return (
@@ -159,10 +525,22 @@ class AnalyzerService:
                     all(required.issubset(f) for f in o["findings"])
                 )
 
-            prompt_base = _deep_prompt(req.html, rule)
+            # ---- находки по одной, пока LLM ещё генерирует ----
+            on_item = None
+            if on_finding:
+                seen: set[Tuple[str, str]] = set()
+
+                def on_item(f: dict) -> None:
+                    # репромпт может повторить находку — отдаём один раз
+                    if not required.issubset(f) or (f["paragraph"], f["quote"]) in seen:
+                        return
+                    seen.add((f["paragraph"], f["quote"]))
+                    on_finding(code, Finding(**f))
+
+            prompt_base = _deep_prompt(doc, rule)
 
             for attempt in range(3):          # 0,1,2
-                obj = await _call(prompt_base)
+                obj = await _ask("deep", prompt_base, DEEP_SHAPE, on_item)
 
                 if _is_valid(obj):            # ✓ формат ок
                     findings = [Finding(**f) for f in obj["findings"]]
@@ -170,15 +548,8 @@ class AnalyzerService:
                                       title=obj["title"],
                                       findings=findings)
 
-                # ─── формируем уточняющий репромпт ──────────
-                prompt_base.append({
-                    "role": "user",
-                    "content": (
-                        "‼️ Формат ответа нарушен: "
-                        f"отсутствуют ключи {required}. "
-                        "Верни ровно JSON указанного формата."
-                    )
-                })
+                # ─── уточняющий репромпт (общий, уже закодирован) ──
+                prompt_base.append(_DEEP_REPAIR_MSG)
 
             # --- 3-я попытка тоже неудачна → заглушка ---
             logging.error("LLM deep %s – 3 ошибки JSON-формата", code)
@@ -193,13 +564,137 @@ class AnalyzerService:
                 )],
             )
 
-        detailed = await asyncio.gather(*(_deep(c) for c in positives))
+        detailed = await _run_stage("deep", (_deep(c) for c in positives))
 
         # 3) Финальная статистика токенов
         token_stat["total"] = token_stat["prompt"] + token_stat["completion"]
-        logging.info("tokens_in=%s", count_tokens(req.html) * len(codes))
+        logging.info(
+            "tokens: planned=%s actual=%s; stages: %s",
+            plan.total_tokens, token_stat["total"],
+            ", ".join(
+                f"{name}[{su.model}] calls={su.calls} tokens={su.prompt + su.completion} {su.seconds}s"
+                for name, su in stage_stat.items() if su.calls
+            ),
+        )
+
+        return AnalyzeResponse(
+            errors=detailed,
+            tokens=TokenStat(**token_stat),
+            stages={name: su for name, su in stage_stat.items() if su.calls},
+        )
+
+    async def plan_batch(self, req: BatchAnalyzeRequest) -> Dict[str, AnalysisPlan]:
+        """Одиночные планы документов пакета (справочники — один раз)."""
+        rules      = self._repo.get_all_rules()
+        groups_map = self._repo.get_all_groups()
+        plans = await asyncio.gather(*(
+            self.plan(req.for_document(d), rules=rules, groups_map=groups_map)
+            for d in req.documents
+        ))
+        return {d.id: p for d, p in zip(req.documents, plans)}
+
+    async def analyze_batch(
+        self,
+        req: BatchAnalyzeRequest,
+        plans: Dict[str, AnalysisPlan] | None = None,
+    ) -> BatchAnalyzeResponse:
+        """
+        Много коротких ТЗ: групповой триаж упаковывается — один вызов
+        на группу и пакет документов (≤ batch_max_prompt_tokens), дальше
+        single/escalation/deep идут по каждому документу как в analyze.
+        Группы, по которым пакетный ответ для документа упал или неполон,
+        триажируются для него отдельно; принятые вердикты не повторяются.
+        """
+        plans = plans or await self.plan_batch(req)
+        docs  = {d.id: d for d in req.documents}
+        # сообщения с id строятся один раз и переиспользуются всеми группами
+        first = next(iter(plans.values()))
+        rules, groups_map = first.rules, first.groups_map
+        groups = first.groups
+        model  = first.models["triage_group"]
+        doc_msgs = dict(zip(docs, await asyncio.gather(*(
+            prepare_document(d.html, [payload_flavor(model)], d.id) for d in req.documents
+        ))))
+        shared = StageUsage(model=model_key(model))
+
+        # --- упаковка: бюджет за вычетом самого «тяжёлого» текста правил ---
+        overhead = max(
+            (_overhead_tokens(_triage_batch_prompt([], groups_map[g], rules)) for g in groups),
+            default=0,
+        )
+        bins = _pack_documents(
+            [(doc_id, p.doc_tokens) for doc_id, p in plans.items()],
+            settings.batch_max_prompt_tokens - overhead,
+            settings.batch_max_documents,
+        )
+        packed = [ids for ids in bins if len(ids) > 1]
+
+        def _spend(usage: dict) -> None:
+            shared.calls += 1
+            shared.prompt += usage.get("prompt_tokens", 0)
+            shared.completion += usage.get("completion_tokens", 0)
+
+        async def _triage_packed(grp_id: str, ids: List[str]) -> dict:
+            """{doc_id: [(code, exists, confidence), …]} по одной группе."""
+            grp = groups_map[grp_id]
+            try:
+                obj, usage = await self._llm(
+                    _triage_batch_prompt([doc_msgs[i] for i in ids], grp, rules),
+                    model=model, shape=TRIAGE_BATCH_SHAPE,
+                )
+            except Exception as exc:
+                logging.error("LLM batch triage error %s %s: %s", grp_id, ids, exc)
+                if isinstance(exc, LLMError) and exc.usage:
+                    _spend(exc.usage)
+                return {}
+            _spend(usage)
+
+            out = {}
+            for d in obj.get("documents", []):
+                triples = [(r["code"], r["exists"], _confidence(r)) for r in d.get("results", [])]
+                # неполный ответ по документу не принимаем — пусть проверится сам
+                if d.get("id") in ids and {c for c, _, _ in triples} >= set(grp["codes"]):
+                    out[d["id"]] = triples
+            return out
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(
+            _triage_packed(g, ids) for ids in packed for g in groups
+        ))
+        shared.seconds = round(time.perf_counter() - t0, 3)
+
+        verdicts: Dict[str, Dict[str, list]] = {}     # doc_id → grp_id → triples
+        for (ids, g), res in zip(((ids, g) for ids in packed for g in groups), results):
+            for doc_id, triples in res.items():
+                verdicts.setdefault(doc_id, {})[g] = triples
+
+        # --- дальше каждый документ сам по себе ---
+        responses = await asyncio.gather(*(
+            self.analyze(
+                req.for_document(docs[doc_id]), plan=plan,
+                group_verdicts=verdicts.get(doc_id),
+            )
+            for doc_id, plan in plans.items()
+        ))
 
-        return AnalyzeResponse(errors=detailed, tokens=TokenStat(**token_stat))
+        token_stat = {
+            "prompt":     shared.prompt + sum(r.tokens.prompt for r in responses),
+            "completion": shared.completion + sum(r.tokens.completion for r in responses),
+        }
+        token_stat["total"] = token_stat["prompt"] + token_stat["completion"]
+        logging.info(
+            "batch: docs=%s packed_bins=%s packed_calls=%s tokens=%s",
+            len(docs), len(packed), shared.calls, token_stat["total"],
+        )
+
+        return BatchAnalyzeResponse(
+            documents=[
+                BatchDocumentResult(id=doc_id, **r.model_dump())
+                for doc_id, r in zip(plans, responses)
+            ],
+            tokens=TokenStat(**token_stat),
+            stages={"triage_group": shared} if shared.calls else {},
+        )
 
     def list_rules(self) -> Dict[str, dict]:
         """Эндпоинт /errors — возвращаем полный справочник из БД."""
@@ -6,20 +6,34 @@ llm.py -> llm_service.py
 но базовый URL и имя модели извлекаются из settings ― их легко
 заменить на альтернативный энд-пойнт/модель без правки кода.
 """
-import re, json,  httpx
+import re, json, time,  httpx
 from pathlib import Path
-from typing import List, Tuple
-from openai import AsyncOpenAI         # официальный клиент ≥ 1.0
+from typing import Callable, List, Tuple
 from tz_expert.settings import settings            # см. ниже
+from tz_expert.utils.payload import EncodedMessage, json_body, aiter_fragments
+from tz_expert.utils.json_stream import IncrementalJSONParser, JSONShape, JSONShapeError
+from tz_expert.utils.offload import run_cpu
+from tz_expert.utils.tokens import count_tokens_async
 import asyncio
-_YC_CONCURRENCY = asyncio.Semaphore(10)   # столько нам разрешено
+YC_MAX_CONCURRENCY = 10                   # столько нам разрешено
+_YC_CONCURRENCY = asyncio.Semaphore(YC_MAX_CONCURRENCY)
+
+DEFAULT_MODEL = "qwen/qwen3-235b-a22b-2507"   # OpenRouter, если model не задана
 
 
 JSON_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.S)  # новая - ищет JSON в markdown-блоках
 JSON_SIMPLE_RE = re.compile(r"\{.*\}", re.S)  # для поиска просто JSON без блоков
 
 class LLMError(RuntimeError):
-    """Исключение при общении с LLM."""
+    """
+    Исключение при общении с LLM.
+    usage — токены, уже потраченные на неудачную попытку (ответ пришёл,
+    но не разобрался, или стрим оборван), чтобы их не потерял учёт.
+    """
+
+    def __init__(self, message: str, usage: dict | None = None):
+        super().__init__(message)
+        self.usage = usage
 
 
 # ── Загружаем system-prompt-ы и схемы 
@@ -28,21 +42,36 @@ PROMPT_DIR = Path(__file__).resolve().parents[2] / "prompts"
 TRIAGE_SYSTEM = (PROMPT_DIR / "triage.system.txt").read_text(encoding="utf-8")
 TRIAGE_GROUP_SYSTEM = (PROMPT_DIR / "triage_group.system.txt").read_text(encoding="utf-8")
 DEEP_SYSTEM   = (PROMPT_DIR / "deep.system.txt").read_text(encoding="utf-8")
+TRIAGE_BATCH_SYSTEM = (PROMPT_DIR / "triage_batch.system.txt").read_text(encoding="utf-8")
+
+# ожидаемая форма ответа — для раннего обрыва при стриминге
+TRIAGE_SHAPE       = JSONShape.from_schema(PROMPT_DIR / "triage.schema.json")
+TRIAGE_GROUP_SHAPE = JSONShape.from_schema(PROMPT_DIR / "triage_group.schema.json")
+DEEP_SHAPE         = JSONShape.from_schema(PROMPT_DIR / "deep.schema.json")
+TRIAGE_BATCH_SHAPE = JSONShape.from_schema(PROMPT_DIR / "triage_batch.schema.json")
+
+# fix-промпт ретрая — общий на всё приложение, кодируется один раз
+_FIX_MESSAGE = EncodedMessage(
+    "user", "❗ Формат нарушен. Верни РОВНО валидный JSON-объект."
+)
 
 # ------------------------------------------------------------------
 #    Инициализируем единственный клиент на всё приложение
 #    (он потокобезопасен и переиспользует HTTP-коннекты)
 # ------------------------------------------------------------------
-# ─── OpenRouter клиент (OpenAI-совместимый) ──────────────────
-or_client = AsyncOpenAI(
-    api_key=settings.or_api_key,
+# ─── OpenRouter сырой HTTP client (OpenAI-совместимый API) ───
+# SDK не умеет отправлять заранее закодированное тело и на каждый
+# вызов заново сериализует весь документ — поэтому httpx напрямую.
+or_client = httpx.AsyncClient(
     base_url=settings.or_base_url,   # "https://openrouter.ai/api/v1"
-    default_headers={
-        "HTTP-Referer": settings.or_referer,
-        "X-Title":      settings.or_title,
+    headers={
+        "Authorization": f"Bearer {settings.or_api_key}",
+        "HTTP-Referer":  settings.or_referer,
+        "X-Title":       settings.or_title,
     },
     timeout=60,
 )
+_OR_MAX_RETRIES = 2                  # как max_retries по умолчанию в openai SDK
 
 # ─── Yandex GPT сырой HTTP client ─────────────────────────────
 yc_client = httpx.AsyncClient(
@@ -52,6 +81,63 @@ yc_client = httpx.AsyncClient(
 )
 
 # ---------- helpers -------------------------------------------------------
+async def _send(
+    client: httpx.AsyncClient,
+    url: str,
+    head: dict,
+    messages: List[dict],
+    flavor: str,
+    *,
+    stream: bool = False,
+    max_retries: int = 0,
+) -> httpx.Response:
+    """
+    POST JSON-тела из готовых фрагментов (см. utils/payload.py).
+    Фрагменты — ссылки на уже закодированные сообщения, поэтому
+    повторная сборка на ретрае ничего не копирует.
+    """
+    frags = json_body(head, messages, flavor)
+    headers = {
+        "Content-Type":   "application/json",
+        "Content-Length": str(sum(len(f) for f in frags)),
+    }
+    for attempt in range(max_retries + 1):
+        request = client.build_request(
+            "POST", url, content=aiter_fragments(frags), headers=headers
+        )
+        try:
+            r = await client.send(request, stream=stream)
+        except httpx.TransportError:
+            if attempt == max_retries:
+                raise
+        else:
+            if (r.status_code != 429 and r.status_code < 500) or attempt == max_retries:
+                return r
+            await r.aclose()
+        await asyncio.sleep(0.5 * 2 ** attempt)
+
+
+def _or_head(model: str, **extra) -> dict:
+    return {
+        "model": model,
+        "temperature": 0,
+        "response_format": {"type": "json_object"},
+        **extra,
+    }
+
+
+def _yc_head(model_uri: str, stream: bool = False) -> dict:
+    head = {
+        "modelUri": model_uri,
+        "generationOptions": {
+            "temperature": 0,
+            "output_type": "JSON_OBJECT",
+            },
+    }
+    if stream:
+        # foundationModels/v1/completion читает флаг только отсюда
+        head["completionOptions"] = {"stream": True}
+    return head
 
 
 # ------------------------------------------------------------------
@@ -78,35 +164,40 @@ def _extract_json(raw: str) -> dict:
         raise LLMError(f"Invalid JSON from LLM: {e}") from e
 
 
+async def _extract_json_async(raw: str) -> dict:
+    """_extract_json; длинный ответ (регэкспы + json.loads) — в пуле."""
+    if len(raw) < settings.cpu_offload_min_chars:
+        return _extract_json(raw)
+    return await run_cpu(_extract_json, raw)
+
 
 async def _call_openrouter(messages: List[dict], model: str):
-    resp = await or_client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0,
-        response_format={"type": "json_object"},
+    r = await _send(
+        or_client, "/chat/completions", _or_head(model), messages, "openai",
+        max_retries=_OR_MAX_RETRIES,
     )
-    content = resp.choices[0].message.content
-    obj = _extract_json(content)
-    usage = resp.usage.model_dump()      # в новом SDK есть .model_dump()
-    return obj, usage
+    if r.status_code != 200:
+        raise RuntimeError(f"OpenRouter {r.status_code}: {r.text[:200]}")
 
-def _oa_to_yc(messages: List[dict]) -> list[dict]:
-    """OpenAI-формат → формат Yandex GPT"""
-    return [{"role": m["role"], "text": m["content"]} for m in messages]
+    data = r.json()
+    content = data["choices"][0]["message"]["content"]
+    usage = data.get("usage") or {}
+    try:
+        obj = await _extract_json_async(content)
+    except LLMError as e:
+        e.usage = usage                   # ответ оплачен, хоть и не разобрался
+        raise
+    return obj, usage
 
 
 async def _call_yandex(messages: List[dict], model_uri: str):
-    payload = {
-        "modelUri": model_uri,
-        "messages": _oa_to_yc(messages),
-        "generationOptions": {
-            "temperature": 0,
-            "output_type": "JSON_OBJECT",
-            },
-    }
+    t0 = time.perf_counter()
     async with _YC_CONCURRENCY:          # ≤10 одновременных входа
-        r = await yc_client.post("/foundationModels/v1/completion", json=payload)
+        queued = time.perf_counter() - t0
+        r = await _send(
+            yc_client, "/foundationModels/v1/completion",
+            _yc_head(model_uri), messages, "yandex",
+        )
     if r.status_code == 429:
         raise RuntimeError("Yandex quota: 429 Too Many Requests")
     if r.status_code != 200:
@@ -116,15 +207,137 @@ async def _call_yandex(messages: List[dict], model_uri: str):
 
     # в YC ответе JSON стоит внутри message.text
     text = data["result"]["alternatives"][0]["message"]["text"]
-    obj = _extract_json(text)
+    usage = {**_yc_usage(data["result"]["usage"]), "queue_seconds": queued}
+    try:
+        obj = await _extract_json_async(text)
+    except LLMError as e:
+        e.usage = usage                   # ответ оплачен, хоть и не разобрался
+        raise
+    return obj, usage
+
 
-    usage = data["result"]["usage"]
-    usage_dict = {
+def _yc_usage(usage: dict) -> dict:
+    return {
         "prompt_tokens": int(usage.get("inputTextTokens", 0)),
         "completion_tokens": int(usage.get("completionTokens", 0)),
         "total_tokens": int(usage.get("totalTokens", 0)),
-    }   
-    return obj, usage_dict
+    }
+
+# -----------------------------------------------------------------
+#  streaming: разбираем JSON по мере генерации, обрываем при браке
+# -----------------------------------------------------------------
+async def _approx_usage(messages: List[dict], completion: str) -> dict:
+    """usage для оборванного стрима: провайдер его уже не пришлёт."""
+    prompt = sum([await count_tokens_async(m["content"]) for m in messages])
+    out = await count_tokens_async(completion)
+    return {"prompt_tokens": prompt, "completion_tokens": out, "total_tokens": prompt + out}
+
+
+async def _stream_error(
+    e: JSONShapeError, parser: IncrementalJSONParser, messages: List[dict],
+) -> LLMError:
+    # «Invalid JSON» в тексте ⇒ _call_with_retry сделает репромпт;
+    # провайдер usage оборванного стрима не пришлёт — считаем сами
+    return LLMError(
+        f"Invalid JSON from LLM (stream aborted): {e}\n{parser.text[:300]}",
+        usage=await _approx_usage(messages, parser.text),
+    )
+
+
+async def _stream_openrouter(
+    messages: List[dict], model: str,
+    shape: JSONShape | None, on_item: Callable[[dict], None] | None,
+):
+    parser = IncrementalJSONParser(shape, on_item)
+    usage = None
+    r = await _send(
+        or_client, "/chat/completions",
+        _or_head(model, stream=True, stream_options={"include_usage": True}),
+        messages, "openai", stream=True, max_retries=_OR_MAX_RETRIES,
+    )
+    try:
+        if r.status_code != 200:
+            await r.aread()
+            raise RuntimeError(f"OpenRouter {r.status_code}: {r.text[:200]}")
+
+        # SSE: «data: {...}», комментарии «: OPENROUTER PROCESSING», «data: [DONE]»
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError as e:
+                raise RuntimeError(f"OpenRouter stream: bad frame {data[:200]}") from e
+            if "error" in chunk:
+                raise RuntimeError(f"OpenRouter stream error: {str(chunk['error'])[:200]}")
+            if chunk.get("usage"):                   # приходит последним чанком
+                usage = chunk["usage"]
+            choices = chunk.get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta and not parser.done:
+                parser.feed(delta)
+        obj = parser.finish()
+    except JSONShapeError as e:
+        raise await _stream_error(e, parser, messages) from e
+    finally:
+        await r.aclose()                             # обрыв ⇒ генерация прекращается
+
+    return obj, usage or await _approx_usage(messages, parser.text)
+
+
+def _yc_stream_result(line: str) -> dict:
+    """result из строки NDJSON-стрима Yandex; кадр с ошибкой — RuntimeError."""
+    try:
+        frame = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise RuntimeError(f"YC stream: bad frame {line[:200]}") from e
+    if "result" not in frame:
+        raise RuntimeError(f"YC stream error: {str(frame.get('error', frame))[:200]}")
+    return frame["result"]
+
+
+async def _stream_yandex(
+    messages: List[dict], model_uri: str,
+    shape: JSONShape | None, on_item: Callable[[dict], None] | None,
+):
+    parser = IncrementalJSONParser(shape, on_item)
+    usage = None
+    t0 = time.perf_counter()
+    async with _YC_CONCURRENCY:
+        queued = time.perf_counter() - t0
+        r = await _send(
+            yc_client, "/foundationModels/v1/completion",
+            _yc_head(model_uri, stream=True), messages, "yandex", stream=True,
+        )
+        try:
+            if r.status_code == 429:
+                raise RuntimeError("Yandex quota: 429 Too Many Requests")
+            if r.status_code != 200:
+                await r.aread()
+                raise RuntimeError(f"YC {r.status_code}: {r.text[:200]}")
+
+            # каждая строка — JSON с накопленным (не дельта!) текстом
+            async for line in r.aiter_lines():
+                if not line.strip():
+                    continue
+                result = _yc_stream_result(line)
+                usage = result.get("usage") or usage
+                text = result["alternatives"][0]["message"]["text"]
+                if not parser.done:
+                    parser.feed(text[len(parser.text):])
+            obj = parser.finish()
+        except JSONShapeError as e:
+            err = await _stream_error(e, parser, messages)
+            err.usage["queue_seconds"] = queued
+            raise err from e
+        finally:
+            await r.aclose()                         # обрыв ⇒ генерация прекращается
+
+    usage = await _approx_usage(messages, parser.text) if usage is None else _yc_usage(usage)
+    return obj, {**usage, "queue_seconds": queued}
 
 # -----------------------------------------------------------------
 #  retry-wrapper: до 2 повторов, если _extract_json бросил LLMError
@@ -133,29 +346,50 @@ async def _call_with_retry(caller, *args, max_retry: int = 2):
     """
     caller  – функция _call_openrouter или _call_yandex
     args[0] – messages (list[dict]); при повторе добавляем fix-prompt
+    (список ссылок: сами сообщения и их JSON не копируются)
     """
-    messages = list(args[0])
+    messages = args[0]
     others   = args[1:]
+    spent: dict = {}                          # usage неудачных попыток
 
     for attempt in range(max_retry + 1):
         try:
-            return await caller(messages, *others)
+            obj, usage = await caller(messages, *others)
+            return obj, _add_usage(dict(usage), spent)
         except LLMError as e:
+            e.usage = _add_usage(dict(e.usage or {}), spent)
             if "Invalid JSON" not in str(e):
                 raise                         # другая причина – пробрасываем
             if attempt == max_retry:
                 raise                         # исчерпаны попытки
-            messages = messages + [{
-                "role": "user",
-                "content": (
-                    "❗ Формат нарушен. Верни РОВНО валидный JSON-объект."
-                ),
-            }]
+            spent = e.usage
+            messages = [*messages, _FIX_MESSAGE]
+
+
+def _add_usage(usage: dict, extra: dict) -> dict:
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens", "queue_seconds"):
+        if key in extra:
+            usage[key] = usage.get(key, 0) + extra[key]
+    return usage
+
+def is_yandex_model(model: str | None) -> bool:
+    """Та же маршрутизация, что в ask_llm: уйдёт ли вызов в Yandex Cloud."""
+    return bool(model) and not model.startswith("openrouter/")
+
+
+def payload_flavor(model: str | None) -> str:
+    """Формат сообщений тела запроса (см. utils/payload.py) для модели."""
+    return "yandex" if is_yandex_model(model) else "openai"
+
 
 # ─── публичная обёртка ────────────────────────────────────────
 async def ask_llm(
         messages: List[dict],
-        model: str | None = None
+        model: str | None = None,
+        *,
+        stream: bool | None = None,
+        shape: JSONShape | None = None,
+        on_item: Callable[[dict], None] | None = None,
 ) -> Tuple[dict, dict]:
     """
     • model == None  →  дефолт Qwen-3-235B через OpenRouter
@@ -164,21 +398,35 @@ async def ask_llm(
     • иначе                              →  считаем строкой-шорткатом Yandex-модели
                                            и просто приклеиваем префикс
                                            gpt://<FOLDER>/ + <model>
+
+    stream (по умолчанию settings.llm_stream, либо True при on_item):
+    ответ разбирается по мере генерации; при расхождении с shape стрим
+    обрывается и идёт репромпт. Элементы shape.items_key → on_item.
+
+    usage: prompt/completion/total_tokens (с учётом неудачных попыток);
+    для Yandex ещё queue_seconds — ожидание семафора YC_MAX_CONCURRENCY.
     """
+    if stream is None:
+        stream = settings.llm_stream or on_item is not None
+    if stream:
+        call_or, call_yc, extra = _stream_openrouter, _stream_yandex, (shape, on_item)
+    else:
+        call_or, call_yc, extra = _call_openrouter, _call_yandex, ()
+
     # ---- 0. Дефолт: Qwen 235B (OpenRouter) -------------------
     if not model:
-        return await _call_with_retry(_call_openrouter, messages,"qwen/qwen3-235b-a22b-2507")
+        return await _call_with_retry(call_or, messages, DEFAULT_MODEL, *extra)
 
     # ---- 1. Полный маршрут OpenRouter ------------------------
     if model.startswith("openrouter/"):
-        return await _call_with_retry(_call_openrouter, messages, model)
+        return await _call_with_retry(call_or, messages, model, *extra)
 
     # ---- 2. Полный URI Yandex Cloud --------------------------
     if model.startswith("gpt://"):
-        return await _call_with_retry(_call_yandex, messages, model)
+        return await _call_with_retry(call_yc, messages, model, *extra)
 
 
     # ---- 3. Короткое имя Yandex → добавляем префикс ----------
     yc_uri = f"gpt://{settings.yc_folder_id}/{model}"
-    return await _call_with_retry(_call_yandex, messages, yc_uri)
+    return await _call_with_retry(call_yc, messages, yc_uri, *extra)
 
@@ -0,0 +1,70 @@
+"""
+loop_lag.py
+-----------
+Лаг event loop: фоновая задача засыпает на interval и меряет, насколько
+позже обещанного её разбудили. Всё, что блокирует loop (tiktoken по
+мегабайтному документу, json.loads большого ответа), видно как всплеск.
+
+Лаг выше settings.loop_lag_warn пишется в лог warning'ом; snapshot()
+отдаёт среднее / p99 / максимум по последним замерам (scripts/bench_loop_lag.py).
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from tz_expert.settings import settings
+
+
+_WINDOW = 600           # замеров в окне snapshot (минута при interval=0.1)
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float | None = None, warn: float | None = None):
+        self.interval = interval or settings.loop_lag_interval
+        self.warn     = warn or settings.loop_lag_warn
+        self._samples: deque[float] = deque(maxlen=_WINDOW)
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - t0 - self.interval)
+            self._samples.append(lag)
+            if lag > self.warn:
+                logging.warning("event loop lag %.0f ms", lag * 1000)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def reset(self) -> None:
+        self._samples.clear()
+
+    def snapshot(self) -> dict:
+        """Миллисекунды по текущему окну замеров."""
+        samples = sorted(self._samples)
+        if not samples:
+            return {"samples": 0, "mean_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        return {
+            "samples": len(samples),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 1),
+            "p99_ms":  round(p99 * 1000, 1),
+            "max_ms":  round(samples[-1] * 1000, 1),
+        }
+
+
+# ─── единственный экземпляр на процесс ────────────────────────
+loop_lag = LoopLagMonitor()
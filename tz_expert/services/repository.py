@@ -5,6 +5,9 @@ Repository: чистый доступ к таблицам error_groups / errors
 """
 
 from contextlib import contextmanager
+from pathlib import Path
+
+import yaml
 from tz_expert.db import SessionLocal
 from tz_expert.models.orm import ErrorGroup, Error
 
@@ -59,3 +62,38 @@ class RuleRepository:
                 }
             return result
 
+
+class YamlRuleRepository:
+    """
+    Тот же интерфейс, что у RuleRepository, но справочник читается
+    из groups.yaml / errors.yaml (как scripts/seed_db.py) — для
+    офлайн-скриптов и бенчмарков без Postgres.
+    """
+
+    def __init__(self, root: Path | None = None):
+        root = root or Path(__file__).resolve().parents[2]
+        self._groups = yaml.safe_load((root / "groups.yaml").read_text(encoding="utf-8"))["groups"]
+        self._errors = yaml.safe_load((root / "errors.yaml").read_text(encoding="utf-8"))
+
+    def get_all_rules(self) -> dict[str, dict]:
+        return {
+            r["code"]: {
+                "code":        r["code"],
+                "title":       r["title"],
+                "description": r["description"],
+                "detector":    r["detector"],
+            }
+            for r in self._errors
+        }
+
+    def get_all_groups(self) -> dict[str, dict]:
+        return {
+            g["id"]: {
+                "id":            g["id"],
+                "name":          g["name"],
+                "system_prompt": g.get("description", ""),
+                "codes":         list(g.get("codes", [])),
+            }
+            for g in self._groups
+            if not g.get("is_deleted", False)
+        }
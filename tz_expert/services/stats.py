@@ -0,0 +1,109 @@
+"""
+stats.py
+--------
+Историческая статистика по LLM-вызовам внутри процесса:
+  • латентность и размер ответа по паре (stage, model) — EWMA;
+  • доля положительных вердиктов триажа по каждому коду.
+
+На ней строится прогноз стоимости запроса (AnalyzerService.plan):
+сколько кодов ожидаемо уйдёт в deep и сколько секунд займёт каждая стадия.
+Пока данных нет — используются априорные значения.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, Tuple
+
+from tz_expert.settings import settings
+
+
+_ALPHA = 0.2            # вес нового наблюдения в EWMA
+_PRIOR_WEIGHT = 5       # «виртуальных» наблюдений у априорной доли позитивов
+_PRIOR_ESCALATION = 0.1 # доля пограничных вердиктов до первых данных
+
+# априорные значения до первых реальных вызовов
+_PRIOR_LATENCY = {
+    "triage_group":  6.0,
+    "triage_single": 3.0,
+    "escalation":    3.0,
+    "deep":          20.0,
+}
+_PRIOR_COMPLETION = {
+    "triage_group":  60,
+    "triage_single": 15,
+    "escalation":    15,
+    "deep":          400,
+}
+
+
+@dataclass
+class StageStat:
+    calls:      int   = 0
+    latency:    float = 0.0     # сек., EWMA
+    completion: float = 0.0     # completion-токены на вызов, EWMA
+
+    def update(self, latency: float, completion: int) -> None:
+        if self.calls == 0:
+            self.latency, self.completion = latency, float(completion)
+        else:
+            self.latency    += _ALPHA * (latency - self.latency)
+            self.completion += _ALPHA * (completion - self.completion)
+        self.calls += 1
+
+
+class StageStatistics:
+    """Потокобезопасность не нужна: всё живёт в одном event loop."""
+
+    def __init__(self):
+        self._stages: Dict[Tuple[str, str], StageStat] = {}
+        self._verdicts: Dict[str, list[int]] = {}     # code → [positives, total]
+        self._escalations = [0, 0]                     # [borderline, total]
+
+    # ---------- запись ----------
+    def record_call(self, stage: str, model: str, latency: float, completion: int) -> None:
+        self._stages.setdefault((stage, model), StageStat()).update(latency, completion)
+
+    def record_verdicts(self, pairs: Iterable[Tuple[str, bool]]) -> None:
+        for code, exists in pairs:
+            hit = self._verdicts.setdefault(code, [0, 0])
+            hit[0] += int(bool(exists))
+            hit[1] += 1
+
+    def record_escalations(self, borderline: int, total: int) -> None:
+        self._escalations[0] += borderline
+        self._escalations[1] += total
+
+    # ---------- прогноз ----------
+    def latency(self, stage: str, model: str) -> float:
+        st = self._stages.get((stage, model))
+        return st.latency if st else _PRIOR_LATENCY[stage]
+
+    def completion(self, stage: str, model: str) -> float:
+        st = self._stages.get((stage, model))
+        return st.completion if st else _PRIOR_COMPLETION[stage]
+
+    def positive_rate(self, code: str) -> float:
+        """Сглаженная доля exists=true; без данных — admission_deep_ratio."""
+        prior = settings.admission_deep_ratio
+        pos, total = self._verdicts.get(code, (0, 0))
+        return (pos + prior * _PRIOR_WEIGHT) / (total + _PRIOR_WEIGHT)
+
+    def escalation_rate(self) -> float:
+        """Сглаженная доля вердиктов триажа, ушедших на эскалацию."""
+        borderline, total = self._escalations
+        return (borderline + _PRIOR_ESCALATION * _PRIOR_WEIGHT) / (total + _PRIOR_WEIGHT)
+
+    def snapshot(self) -> dict:
+        return {
+            "stages": {
+                f"{stage}:{model}": vars(st)
+                for (stage, model), st in self._stages.items()
+            },
+            "positive_rate": {
+                code: self.positive_rate(code) for code in self._verdicts
+            },
+            "escalation_rate": self.escalation_rate(),
+        }
+
+
+# ─── единственный экземпляр на процесс ────────────────────────
+stage_stats = StageStatistics()
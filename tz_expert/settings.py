@@ -22,6 +22,34 @@ class Settings(BaseSettings):
 
     # ---------- LLM Model ----------
     llm_model: str = Field('openrouter/openai/gpt-4o-mini', env='LLM_MODEL')  # <- добавьте эту строку
+    llm_stream: bool = Field(False, env='LLM_STREAM')   # стриминг ответа + ранний обрыв по форме JSON
+
+    # ---------- Каскад моделей по стадиям (None → дефолт ask_llm) ----------
+    llm_model_triage_group:  str | None = Field(None, env='LLM_MODEL_TRIAGE_GROUP')
+    llm_model_triage_single: str | None = Field(None, env='LLM_MODEL_TRIAGE_SINGLE')
+    llm_model_deep:          str | None = Field(None, env='LLM_MODEL_DEEP')
+    llm_model_escalation:    str | None = Field(None, env='LLM_MODEL_ESCALATION')   # None → модель deep
+    escalation_threshold: float = Field(0.7, env='ESCALATION_THRESHOLD')   # confidence ниже → сильная модель
+
+    # ---------- Пакетный триаж (/analyze/batch) ----------
+    batch_max_prompt_tokens: int = Field(24_000, env='BATCH_MAX_PROMPT_TOKENS')   # лимит упакованного промпта
+    batch_max_documents:     int = Field(8, env='BATCH_MAX_DOCUMENTS')            # документов в одном вызове
+
+    # ---------- Admission control (на один воркер) ----------
+    admission_max_tokens: int = Field(2_000_000, env='ADMISSION_MAX_TOKENS')   # токенов «в полёте»
+    admission_max_calls:  int = Field(200, env='ADMISSION_MAX_CALLS')          # LLM-вызовов «в полёте»
+    admission_max_queue:  int = Field(16, env='ADMISSION_MAX_QUEUE')           # сколько запросов может ждать
+    admission_max_wait:   float = Field(5.0, env='ADMISSION_MAX_WAIT')         # сек. ожидания в очереди, 0 — сразу 503
+    admission_retry_after: int = Field(10, env='ADMISSION_RETRY_AFTER')        # значение заголовка Retry-After
+    admission_deep_ratio: float = Field(0.3, env='ADMISSION_DEEP_RATIO')       # доля кодов, ожидаемо уходящих в deep
+
+    # ---------- CPU-тяжёлые шаги вне event loop ----------
+    cpu_pool_kind:    str = Field('process', env='CPU_POOL_KIND')        # process | thread | inline
+    cpu_pool_workers: int = Field(2, env='CPU_POOL_WORKERS')             # процессов/потоков в пуле
+    cpu_pool_max_pending: int = Field(32, env='CPU_POOL_MAX_PENDING')    # задач в пуле одновременно, остальные ждут
+    cpu_offload_min_chars: int = Field(50_000, env='CPU_OFFLOAD_MIN_CHARS')   # текст короче — считаем на месте
+    loop_lag_interval: float = Field(0.1, env='LOOP_LAG_INTERVAL')       # сек. между замерами лага event loop
+    loop_lag_warn:     float = Field(0.1, env='LOOP_LAG_WARN')           # лаг больше — пишем warning
 
     @property
     def yc_model(self) -> str:
@@ -0,0 +1,213 @@
+# json_stream.py
+"""
+Инкрементальный разбор JSON-ответа LLM, который приходит кусками (stream).
+
+• Как только вывод перестаёт соответствовать ожидаемой форме
+  (нет «{» в начале, лишний ключ верхнего уровня, битые скобки,
+  пропущенные «,» / «:», голые слова вместо значений) — бросаем
+  JSONShapeError, и вызывающий код может оборвать генерацию.
+  Последовательность токенов проверяется на каждом уровне вложенности;
+  содержимое строк и чисел окончательно проверяет json.loads при
+  закрытии элемента / корня.
+• Элементы массива items_key (findings / results) отдаются в on_item
+  по одному, сразу после закрывающей «}».
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+_CTRL_RE = re.compile(r"[\x00-\x1f\x7f]")
+_MAX_PREAMBLE = 200        # столько символов «болтовни» терпим до первой «{»
+
+# скаляр вне строки: число или true / false / null
+_SCALAR_CHARS = frozenset("0123456789+-.eEtrufalsn")
+_SCALAR_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+_WS = frozenset(" \t\r\n")
+
+
+class JSONShapeError(ValueError):
+    """Поток больше не может стать ожидаемым JSON-объектом."""
+
+
+class JSONShape(NamedTuple):
+    keys: frozenset            # допустимые ключи верхнего уровня
+    items_key: str | None = None
+
+    @classmethod
+    def from_schema(cls, path: Path) -> "JSONShape":
+        """Форма из prompts/*.schema.json: properties + первый массив."""
+        params = json.loads(path.read_text(encoding="utf-8"))["parameters"]
+        props = params["properties"]
+        items_key = next(
+            (k for k, v in props.items() if v.get("type") == "array"), None
+        )
+        return cls(frozenset(props), items_key)
+
+
+def _loads(text: str):
+    # как в _extract_json: вырезаем \x00–\x1F, \x7F
+    return json.loads(_CTRL_RE.sub("", text))
+
+
+class _Frame:
+    __slots__ = ("kind", "key", "start", "last_key", "state", "empty")
+
+    def __init__(self, kind: str, key: str | None, start: int):
+        self.kind = kind              # "{" | "["
+        self.key = key                # ключ, под которым лежит контейнер
+        self.start = start
+        self.last_key: str | None = None
+        # что ждём дальше: "key" → "colon" → "value" → "comma" (у массива без ключа)
+        self.state = "key" if kind == "{" else "value"
+        self.empty = True             # ещё ни одного элемента — можно закрыть сразу
+
+    def after_comma(self) -> None:
+        self.state = "key" if self.kind == "{" else "value"
+
+
+class IncrementalJSONParser:
+    """
+    parser = IncrementalJSONParser(shape, on_item)
+    for chunk in stream:
+        if parser.feed(chunk):   # корневой объект закрыт
+            break
+    obj = parser.finish()
+    """
+
+    def __init__(
+        self,
+        shape: JSONShape | None = None,
+        on_item: Callable[[dict], None] | None = None,
+    ):
+        self.shape = shape
+        self.on_item = on_item
+        self.text = ""
+        self.result: dict | None = None
+
+        self._pos = 0
+        self._stack: list[_Frame] = []
+        self._in_str = False
+        self._esc = False
+        self._str_start = 0
+        self._scalar_start: int | None = None
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def feed(self, chunk: str) -> bool:
+        if self.done:
+            return True
+        self.text += chunk
+        text = self.text
+
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+
+            # ---------- до корневой «{» ----------
+            if not self._stack:
+                if ch == "{":
+                    self._stack.append(_Frame("{", None, i))
+                elif i >= _MAX_PREAMBLE:
+                    raise JSONShapeError(f"no JSON object in first {_MAX_PREAMBLE} chars")
+                continue
+
+            # ---------- внутри строки ----------
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                    self._on_string(text[self._str_start + 1:i])
+                continue
+
+            # ---------- число / литерал: до разделителя ----------
+            if self._scalar_start is not None:
+                if ch in _SCALAR_CHARS:
+                    continue
+                token = text[self._scalar_start:i]
+                self._scalar_start = None
+                if not _SCALAR_RE.fullmatch(token):
+                    raise JSONShapeError(f"bad token {token!r} at {i - len(token)}")
+                # сам разделитель разбираем ниже
+
+            if ch in _WS:
+                continue
+            top = self._stack[-1]
+            if ch == '"':
+                if top.state not in ("key", "value"):
+                    raise JSONShapeError(f"unexpected string at {i}")
+                self._in_str, self._str_start = True, i
+                top.empty = False
+            elif ch == ":":
+                if top.state != "colon":
+                    raise JSONShapeError(f"unexpected ':' at {i}")
+                top.state = "value"
+            elif ch == ",":
+                if top.state != "comma":
+                    raise JSONShapeError(f"unexpected ',' at {i}")
+                top.after_comma()
+            elif ch in "{[":
+                if top.state != "value":
+                    raise JSONShapeError(f"unexpected {ch!r} at {i}")
+                top.state, top.empty = "comma", False
+                key = top.last_key if top.kind == "{" else top.key
+                self._open(ch, key, i)
+            elif ch in "}]":
+                if (ch == "}") != (top.kind == "{"):
+                    raise JSONShapeError(f"unbalanced {ch!r} at {i}")
+                if top.state != "comma" and not top.empty:
+                    raise JSONShapeError(f"unexpected {ch!r} at {i}")
+                self._stack.pop()
+                self._close(top, i)
+                if self.done:
+                    self._pos = i + 1
+                    return True
+            elif ch in _SCALAR_CHARS and top.state == "value":
+                top.state, top.empty = "comma", False
+                self._scalar_start = i
+            else:
+                raise JSONShapeError(f"unexpected {ch!r} at {i}")
+
+        self._pos = len(text)
+        return False
+
+    def finish(self) -> dict:
+        if not self.done:
+            raise JSONShapeError("stream ended before JSON object was closed")
+        return self.result
+
+    # ---------- внутреннее ----------
+    def _on_string(self, value: str) -> None:
+        top = self._stack[-1]
+        if top.state == "value":
+            top.state = "comma"
+            return
+        top.last_key, top.state = value, "colon"
+        if len(self._stack) == 1 and self.shape and value not in self.shape.keys:
+            raise JSONShapeError(f"unexpected key {value!r}")
+
+    def _open(self, kind: str, key: str | None, i: int) -> None:
+        if (
+            self.shape and self.shape.items_key and
+            len(self._stack) == 1 and key == self.shape.items_key and kind != "["
+        ):
+            raise JSONShapeError(f"{key!r} must be an array")
+        self._stack.append(_Frame(kind, key, i))
+
+    def _close(self, frame: _Frame, i: int) -> None:
+        try:
+            if not self._stack:                       # закрыт корень
+                self.result = _loads(self.text[frame.start:i + 1])
+            elif (
+                self.on_item and frame.kind == "{" and
+                len(self._stack) == 2 and self._stack[-1].kind == "[" and
+                self.shape and frame.key == self.shape.items_key
+            ):
+                self.on_item(_loads(self.text[frame.start:i + 1]))
+        except json.JSONDecodeError as e:
+            raise JSONShapeError(f"invalid JSON: {e}") from e
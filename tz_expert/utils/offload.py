@@ -0,0 +1,91 @@
+# offload.py
+"""
+CPU-тяжёлые шаги (tiktoken по всему документу, разбор больших ответов
+LLM, JSON-кодирование документа) — вне event loop.
+
+Пул один на процесс, создаётся лениво; вид задаётся settings.cpu_pool_kind:
+  • process — ProcessPoolExecutor (spawn), GIL не мешает;
+  • thread  — ThreadPoolExecutor, дешевле на передаче данных;
+  • inline  — прямо в loop, как раньше (для отладки и замеров «до»).
+
+Очередь ограничена: в пуле одновременно не больше cpu_pool_max_pending
+задач, остальные корутины ждут на семафоре, а не копят документы в памяти
+executor'а.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, TypeVar
+
+from tz_expert.settings import settings
+
+T = TypeVar("T")
+
+_executor: Executor | None = None
+_slots = asyncio.Semaphore(settings.cpu_pool_max_pending)
+
+
+def _make_executor() -> Executor | None:
+    kind = settings.cpu_pool_kind
+    if kind == "process":
+        # spawn: fork процесса с живым event loop и HTTP-клиентами небезопасен
+        return ProcessPoolExecutor(
+            max_workers=settings.cpu_pool_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    if kind == "thread":
+        return ThreadPoolExecutor(
+            max_workers=settings.cpu_pool_workers, thread_name_prefix="cpu"
+        )
+    if kind == "inline":
+        return None
+    raise ValueError(f"Unknown CPU_POOL_KIND: {kind!r}")
+
+
+def get_executor() -> Executor | None:
+    global _executor
+    if _executor is None:
+        _executor = _make_executor()
+    return _executor
+
+
+def shutdown_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_cpu(fn: Callable[..., T], *args) -> T:
+    """
+    fn(*args) в пуле. fn и аргументы должны pickle-иться (модульные
+    функции, строки/байты) — для process-пула они копируются в воркер.
+    """
+    executor = get_executor()
+    if executor is None:
+        return fn(*args)
+
+    async with _slots:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # воркер убит (OOM и т. п.) — следующий вызов поднимет новый пул
+            logging.error("CPU pool is broken, recreating")
+            shutdown_pool()
+            raise
+
+
+async def start_pool() -> None:
+    """Поднять воркеры заранее, чтобы первый запрос не ждал spawn + импорт tiktoken."""
+    from tz_expert.utils.tokens import warm_up
+
+    executor = get_executor()
+    if executor is None:
+        return
+    await asyncio.gather(*(
+        run_cpu(warm_up, settings.llm_model) for _ in range(settings.cpu_pool_workers)
+    ))
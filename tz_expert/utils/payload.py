@@ -0,0 +1,90 @@
+# payload.py
+"""
+Сборка тела chat-запроса без лишних копий документа.
+
+Документ (часто мегабайты HTML) оборачивается в EncodedMessage один раз
+на запрос: f-строка <DOCUMENT>…</DOCUMENT> и её JSON-кодирование
+выполняются однократно и затем переиспользуются всеми вызовами —
+triage, deep, ретраями. Тело запроса собирается из списка bytes-фрагментов
+и отдаётся httpx потоком, без склейки в один большой буфер.
+"""
+
+import asyncio
+import json
+from typing import AsyncIterator, Iterable, List
+
+from tz_expert.settings import settings
+from tz_expert.utils.offload import run_cpu
+
+
+# провайдер → имя поля с текстом сообщения
+_TEXT_KEY = {"openai": "content", "yandex": "text"}
+
+
+class EncodedMessage(dict):
+    """
+    Обычное сообщение {"role", "content"} (всё, что читает dict, работает
+    как раньше) + кэш его JSON-представления под каждого провайдера.
+    """
+    __slots__ = ("_encoded",)
+
+    def __init__(self, role: str, content: str):
+        super().__init__(role=role, content=content)
+        self._encoded: dict[str, bytes] = {}
+
+    def encoded(self, flavor: str) -> bytes:
+        data = self._encoded.get(flavor)
+        if data is None:
+            data = _encode(self, flavor)
+            self._encoded[flavor] = data
+        return data
+
+
+def _encode(message: dict, flavor: str) -> bytes:
+    return json.dumps(
+        {"role": message["role"], _TEXT_KEY[flavor]: message["content"]},
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+
+def document_message(html: str, doc_id: str | None = None) -> EncodedMessage:
+    """user-сообщение с документом; строится один раз на запрос."""
+    if doc_id is None:
+        return EncodedMessage("user", f"<DOCUMENT>{html}</DOCUMENT>")
+    return EncodedMessage("user", f'<DOCUMENT id="{doc_id}">{html}</DOCUMENT>')
+
+
+async def prepare_document(
+    html: str, flavors: Iterable[str], doc_id: str | None = None,
+) -> EncodedMessage:
+    """
+    document_message с JSON, закодированным заранее под нужных провайдеров.
+    Большой документ кодируется в пуле (utils/offload.py) — иначе это
+    делал бы первый же _send прямо в event loop.
+    """
+    msg = document_message(html, doc_id)
+    if len(html) >= settings.cpu_offload_min_chars:
+        flavors = list(dict.fromkeys(flavors))
+        encoded = await asyncio.gather(*(run_cpu(_encode, dict(msg), f) for f in flavors))
+        msg._encoded.update(zip(flavors, encoded))
+    return msg
+
+
+def json_body(head: dict, messages: Iterable[dict], flavor: str) -> List[bytes]:
+    """
+    Фрагменты JSON-тела {**head, "messages": [...]}.
+    EncodedMessage отдают готовые байты, прочие сообщения (короткие
+    правила, fix-промпты) кодируются на месте.
+    """
+    frags = [json.dumps(head, ensure_ascii=False)[:-1].encode("utf-8"), b', "messages": [']
+    for i, m in enumerate(messages):
+        if i:
+            frags.append(b",")
+        frags.append(m.encoded(flavor) if isinstance(m, EncodedMessage) else _encode(m, flavor))
+    frags.append(b"]}")
+    return frags
+
+
+async def aiter_fragments(frags: List[bytes]) -> AsyncIterator[bytes]:
+    for f in frags:
+        yield f
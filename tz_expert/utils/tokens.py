@@ -1,11 +1,22 @@
 # tokens.py
+import asyncio
+import hashlib
+from collections import OrderedDict
+
 import tiktoken
 from tz_expert.settings import settings  # ✅ прямой импорт, а не алиас
+from tz_expert.utils.offload import run_cpu
 
 _enc_cache: dict[str, tiktoken.Encoding] = {}
 
-def count_tokens(text: str) -> int:
-    model = settings.llm_model
+# (model, sha256 текста) → число токенов; LRU, чтобы не расти бесконечно
+_COUNT_CACHE_SIZE = 512
+_count_cache: "OrderedDict[tuple[str, str], int]" = OrderedDict()
+# тот же документ уже токенизируется (/estimate и /analyze разом) — ждём его
+_in_flight: dict[tuple[str, str], asyncio.Task] = {}
+
+
+def _encoding(model: str) -> tiktoken.Encoding:
     enc = _enc_cache.get(model)
     if enc is None:
         try:
@@ -13,4 +24,70 @@ def count_tokens(text: str) -> int:
         except KeyError:
             enc = tiktoken.get_encoding("cl100k_base")
         _enc_cache[model] = enc
-    return len(enc.encode(text))
\ No newline at end of file
+    return enc
+
+
+def count_tokens(text: str, model: str | None = None) -> int:
+    return len(_encoding(model or settings.llm_model).encode(text))
+
+
+def warm_up(model: str) -> None:
+    """Загрузить кодировку в воркере пула (см. offload.start_pool)."""
+    _encoding(model)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _remember(key: tuple[str, str], n: int) -> None:
+    _count_cache[key] = n
+    if len(_count_cache) > _COUNT_CACHE_SIZE:
+        _count_cache.popitem(last=False)
+
+
+def _cached(key: tuple[str, str]) -> int | None:
+    n = _count_cache.get(key)
+    if n is not None:
+        _count_cache.move_to_end(key)
+    return n
+
+
+def count_tokens_cached(text: str) -> int:
+    """count_tokens с мемоизацией по хэшу: повторная токенизация того же
+    документа (/estimate → /analyze) ничего не стоит."""
+    key = (settings.llm_model, text_hash(text))
+    n = _cached(key)
+    if n is None:
+        n = count_tokens(text, key[0])
+        _remember(key, n)
+    return n
+
+
+async def count_tokens_async(text: str) -> int:
+    """
+    count_tokens_cached для event loop: длинный текст токенизируется
+    в пуле (utils/offload.py), короткий — на месте.
+    Кэш общий с count_tokens_cached.
+    """
+    model = settings.llm_model
+    if len(text) < settings.cpu_offload_min_chars:
+        return count_tokens_cached(text)
+
+    key = (model, text_hash(text))
+    n = _cached(key)
+    if n is not None:
+        return n
+
+    task = _in_flight.get(key)
+    if task is None:
+        # отдельная задача: отмена одного из ждущих запросов её не прерывает
+        task = asyncio.create_task(run_cpu(count_tokens, text, model))
+        _in_flight[key] = task
+
+        def _done(t: asyncio.Task) -> None:
+            del _in_flight[key]
+            if not t.cancelled() and t.exception() is None:
+                _remember(key, t.result())
+        task.add_done_callback(_done)
+    return await asyncio.shield(task)